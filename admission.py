@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Rejected(Exception):
+    """请求未被接纳：status 为 429（队列已满）或 503（排队超时），retry_after 为建议的重试秒数"""
+
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """一次接纳申请：reserve() 时已占用执行名额或排队位置"""
+
+    __slots__ = ("admitted", "enqueued_at")
+
+    def __init__(self, admitted, enqueued_at):
+        self.admitted = admitted
+        self.enqueued_at = enqueued_at
+
+
+class AdmissionQueue:
+    """有界接纳队列：最多 max_active 个请求同时执行，最多 max_queue 个请求排队等待
+
+    队列已满时立即拒绝（429），排队超过 max_wait 秒仍未轮到时拒绝（503），
+    避免请求在连接积压中超时而服务端仍在做无用功。只在当前进程内生效。
+    """
+
+    def __init__(self, max_active, max_queue, max_wait):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds_sum = 0.0
+        self.wait_seconds_max = 0.0
+        self.service_seconds_sum = 0.0
+        self.service_count = 0
+
+    def retry_after(self):
+        """按平均处理时间估算排队的请求全部处理完所需的秒数（至少 1 秒）"""
+        mean = self.service_seconds_sum / self.service_count if self.service_count else 1.0
+        return max(1, math.ceil(mean * (self.waiting + 1) / self.max_active))
+
+    def check(self):
+        """不占用名额，只在队列已满时立即拒绝；用于读取上传内容之前快速失败"""
+        with self._cond:
+            if self.active >= self.max_active and self.waiting >= self.max_queue:
+                self.rejected_full += 1
+                raise Rejected(429, self.retry_after(), "服务繁忙，等待队列已满")
+
+    def reserve(self):
+        """申请执行名额：有空闲名额且无人排队时直接占用，否则进入等待队列；队列已满时抛出 Rejected(429)"""
+        with self._cond:
+            now = time.monotonic()
+            if self.active < self.max_active and self.waiting == 0:
+                self.active += 1
+                self._record_admit(0.0)
+                return Ticket(True, now)
+            if self.waiting >= self.max_queue:
+                self.rejected_full += 1
+                raise Rejected(429, self.retry_after(), "服务繁忙，等待队列已满")
+            self.waiting += 1
+            return Ticket(False, now)
+
+    def wait(self, ticket, timeout=None):
+        """等待排队中的申请获得执行名额；timeout 默认为 max_wait，超时抛出 Rejected(503)"""
+        if ticket.admitted:
+            return
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = ticket.enqueued_at + timeout
+        with self._cond:
+            while self.active >= self.max_active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiting -= 1
+                    self.rejected_timeout += 1
+                    raise Rejected(503, self.retry_after(), "服务繁忙，排队超时")
+                self._cond.wait(remaining)
+            self.waiting -= 1
+            self.active += 1
+            ticket.admitted = True
+            self._record_admit(time.monotonic() - ticket.enqueued_at)
+
+    def cancel(self, ticket):
+        """放弃申请：已获得的名额归还，排队中的退出队列（不计入处理时间）"""
+        with self._cond:
+            if ticket.admitted:
+                self.active -= 1
+                self._cond.notify()
+            else:
+                self.waiting -= 1
+
+    def acquire(self, timeout=None):
+        """申请并等待执行名额，返回开始执行的时间，用完后调用 release()"""
+        ticket = self.reserve()
+        self.wait(ticket, timeout)
+        return time.monotonic()
+
+    def release(self, started):
+        """释放执行名额，started 为开始执行时的 time.monotonic()"""
+        with self._cond:
+            self.active -= 1
+            self.service_seconds_sum += time.monotonic() - started
+            self.service_count += 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, timeout=None):
+        """申请并等待执行名额，离开时释放"""
+        started = self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def _record_admit(self, waited):
+        self.admitted_total += 1
+        self.wait_seconds_sum += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def metrics(self, prefix="conversion"):
+        """以 Prometheus 文本格式导出队列深度、等待时间和拒绝次数"""
+        with self._cond:
+            lines = [
+                f"# TYPE {prefix}_active gauge",
+                f"{prefix}_active {self.active}",
+                f"# TYPE {prefix}_queue_depth gauge",
+                f"{prefix}_queue_depth {self.waiting}",
+                f"# TYPE {prefix}_max_active gauge",
+                f"{prefix}_max_active {self.max_active}",
+                f"# TYPE {prefix}_max_queue gauge",
+                f"{prefix}_max_queue {self.max_queue}",
+                f"# TYPE {prefix}_admitted_total counter",
+                f"{prefix}_admitted_total {self.admitted_total}",
+                f"# TYPE {prefix}_rejected_total counter",
+                f'{prefix}_rejected_total{{reason="queue_full"}} {self.rejected_full}',
+                f'{prefix}_rejected_total{{reason="timeout"}} {self.rejected_timeout}',
+                f"# TYPE {prefix}_wait_seconds summary",
+                f"{prefix}_wait_seconds_sum {self.wait_seconds_sum:.3f}",
+                f"{prefix}_wait_seconds_count {self.admitted_total}",
+                f"# TYPE {prefix}_wait_seconds_max gauge",
+                f"{prefix}_wait_seconds_max {self.wait_seconds_max:.3f}",
+                f"# TYPE {prefix}_service_seconds summary",
+                f"{prefix}_service_seconds_sum {self.service_seconds_sum:.3f}",
+                f"{prefix}_service_seconds_count {self.service_count}",
+            ]
+        return "\n".join(lines) + "\n"
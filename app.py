@@ -1,12 +1,116 @@
-from flask import Flask, request, send_file, render_template_string
+from flask import Flask, request, send_file, render_template_string, Response, jsonify, g
 import os
-from script_generator import ScriptGenerator
+import re
+import json
+import time
+import uuid
+import zlib
+import mmap
+import fcntl
+import shutil
+import threading
+import zipfile
 import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from script_generator import ScriptGenerator, register_font, profile_call, RENDERERS, PDF_PROFILES
+import script_generator
+import rules
+import corpus
+import search
+import admission
+import tracing
 
 # 创建Flask应用实例
 application = Flask(__name__)
 app = application  # 为了兼容性，同时提供app变量
 
+# 各输出格式的 MIME 类型
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'json': 'application/json',
+}
+
+# 检索索引数据库（设置后每次转换的结果都会增量写入索引）
+INDEX_DB = os.environ.get('INDEX_DB')
+
+# 性能分析：设置 PROFILE_REQUESTS=1 后，请求带 X-Profile: 1 头时该次转换在 cProfile 下运行，
+# 结果写入 PROFILE_DIR/<id>_profile.prof 和 .txt，响应头 X-Profile-Id 返回 id；超过 JOB_TTL 的结果自动清理
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'script_profiles'))
+
+# 批量转换配置
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 2))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 100))
+BATCH_CHUNK_SIZE = 1024 * 1024  # 批量ZIP每次发送的数据块大小
+
+# 异步转换任务配置：任务目录放在本机共享的临时目录下，多个 gunicorn worker 都能读到进度
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(tempfile.gettempdir(), 'script_jobs'))
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+SSE_POLL_INTERVAL = 0.2
+SSE_KEEPALIVE = 15
+# 单个事件流最长保持的秒数，到时结束，浏览器带 Last-Event-ID 自动重连并从断点继续（避免长期占用线程）
+SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 300))
+# 执行任务的进程每隔 JOB_HEARTBEAT_INTERVAL 秒更新任务目录下的 heartbeat 文件；
+# 超过 JOB_STALE_AFTER 秒未更新（或所属进程已退出）时，视为进程重启/超时，任务记为出错
+JOB_HEARTBEAT_INTERVAL = 5
+JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 60))
+
+# 分块上传配置：上传中的文件按块追加到 UPLOADS_DIR 下的暂存文件，断线后从已确认的偏移量继续
+UPLOADS_DIR = os.environ.get('UPLOADS_DIR', os.path.join(tempfile.gettempdir(), 'script_uploads'))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 2 * 1024 * 1024 * 1024))
+
+# 接纳控制（每个 worker 进程独立计数）：同时执行的转换数、排队上限和最长排队秒数，
+# 超出时立即返回 429/503 和 Retry-After，而不是让请求在连接积压中超时
+MAX_CONCURRENT_CONVERSIONS = int(os.environ.get('MAX_CONCURRENT_CONVERSIONS', 2))
+MAX_QUEUED_CONVERSIONS = int(os.environ.get('MAX_QUEUED_CONVERSIONS', 8))
+MAX_QUEUE_WAIT = float(os.environ.get('MAX_QUEUE_WAIT', 30))
+conversion_queue = admission.AdmissionQueue(MAX_CONCURRENT_CONVERSIONS, MAX_QUEUED_CONVERSIONS, MAX_QUEUE_WAIT)
+# 异步任务（/jobs、分块上传）使用独立的名额，不占用 /convert 的名额：异步任务可以排队到任务过期，
+# 共用名额时会长时间挤占同步转换；异步任务在后台线程中排队，不占用 gunicorn 的请求线程
+MAX_BACKGROUND_CONVERSIONS = int(os.environ.get('MAX_BACKGROUND_CONVERSIONS', 1))
+MAX_QUEUED_BACKGROUND = int(os.environ.get('MAX_QUEUED_BACKGROUND', 16))
+background_queue = admission.AdmissionQueue(MAX_BACKGROUND_CONVERSIONS, MAX_QUEUED_BACKGROUND, MAX_QUEUE_WAIT)
+# 批量转换再单独计数：一个批量请求会分发给 BATCH_WORKERS 个子进程并占用名额直到 ZIP 发送完毕，
+# 与网页上传共用名额时交互式转换要排在整个批量之后
+MAX_CONCURRENT_BATCHES = int(os.environ.get('MAX_CONCURRENT_BATCHES', 1))
+MAX_QUEUED_BATCHES = int(os.environ.get('MAX_QUEUED_BATCHES', 2))
+batch_queue = admission.AdmissionQueue(MAX_CONCURRENT_BATCHES, MAX_QUEUED_BATCHES, MAX_QUEUE_WAIT)
+
+# 模板预检：识别到的模板页面类型占比低于该值的文件直接拒绝（设为 0 则只标记不拒绝）
+PREFLIGHT_MIN_CONFIDENCE = float(os.environ.get('PREFLIGHT_MIN_CONFIDENCE', 0.25))
+
+# 批量转换进程池（首次使用时创建）
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+# 批量转换的子进程由 forkserver 启动：gthread worker 是多线程进程，直接 fork 会把其他线程持有的锁
+# （日志、字体注册、sqlite 连接）复制到子进程中而可能死锁；forkserver 预先导入本模块，启动子进程仍然很快
+_batch_mp_context = multiprocessing.get_context('forkserver')
+_batch_mp_context.set_forkserver_preload(['app'])
+
+# 本进程中尚未结束的异步任务目录，由心跳线程定时更新
+_active_jobs = set()
+_active_jobs_lock = threading.Lock()
+_heartbeat_thread = None
+
+# 预热完成标志：gunicorn preload 时在主进程中预热，fork 出的 worker 继承该状态
+_ready = False
+
+def warm_up():
+    """预加载模块、字体、样式和规则，完成后 /readyz 才返回就绪"""
+    global _ready
+    if _ready:
+        return
+    script_generator.warm_up()
+    rules.get_rules()
+    _ready = True
+
+def is_ready():
+    return _ready
+
 # 简单的HTML模板
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -42,23 +146,268 @@ HTML_TEMPLATE = '''
 <body>
     <h1>PPT转换工具</h1>
     <div class="upload-form">
-        <form action="/convert" method="post" enctype="multipart/form-data">
+        <form id="convert-form" action="/convert" method="post" enctype="multipart/form-data">
             <p>请选择要转换的PPT文件 (.pptx)</p>
             <input type="file" name="file" accept=".pptx" required>
+            <select name="format">
+                <option value="pdf">PDF</option>
+                <option value="docx">Word (DOCX)</option>
+            </select>
+            <select name="pdf_profile">
+                <option value="">PDF质量：默认</option>
+                <option value="draft">草稿（最小）</option>
+                <option value="screen">屏幕查看</option>
+                <option value="print">打印</option>
+            </select>
             <br><br>
             <input type="submit" value="转换" class="button">
         </form>
+        <p id="progress"></p>
     </div>
+    <div class="upload-form">
+        <form action="/convert_batch" method="post" enctype="multipart/form-data">
+            <p>批量转换：可同时选择多个PPT文件，结果打包为ZIP下载</p>
+            <input type="file" name="files" accept=".pptx" multiple required>
+            <br><br>
+            <input type="submit" value="批量转换" class="button">
+        </form>
+    </div>
+    <script>
+        // 分块上传（断线后从服务端已确认的位置继续），上传完成后用 Server-Sent Events 显示转换进度；
+        // 浏览器不支持时退回普通表单提交
+        var STAGES = {
+            parse: '正在解析文件...',
+            pdf: '正在生成PDF...',
+            docx: '正在生成Word文档...',
+            images: '正在处理图片...',
+            build: '正在排版输出...',
+            done: '即将完成...'
+        };
+        var form = document.getElementById('convert-form');
+        var progress = document.getElementById('progress');
+        var MAX_RETRIES = 20;
+
+        var CRC_TABLE = [];
+        for (var n = 0; n < 256; n++) {
+            var c = n;
+            for (var k = 0; k < 8; k++) {
+                c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+            }
+            CRC_TABLE[n] = c >>> 0;
+        }
+        function crc32(bytes) {
+            var crc = 0xFFFFFFFF;
+            for (var i = 0; i < bytes.length; i++) {
+                crc = CRC_TABLE[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+            }
+            return ((crc ^ 0xFFFFFFFF) >>> 0).toString(16);
+        }
+
+        function sleep(ms) {
+            return new Promise(function (resolve) { setTimeout(resolve, ms); });
+        }
+        function retryDelay(resp) {
+            return (parseInt(resp.headers.get('Retry-After'), 10) || 2) * 1000;
+        }
+        function failed(resp) {
+            return resp.text().then(function (text) {
+                var message = text;
+                try {
+                    message = JSON.parse(text).error || text;
+                } catch (e) {}
+                throw new Error(message);
+            });
+        }
+
+        // 同一文件再次提交时沿用未完成的上传
+        function startUpload(file) {
+            var key = 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+            var saved = window.localStorage && localStorage.getItem(key);
+            var resume = saved
+                ? fetch('/uploads/' + saved).then(function (resp) { return resp.ok ? resp.json() : null; })
+                : Promise.resolve(null);
+            return resume.catch(function () { return null; }).then(function (status) {
+                if (status && !status.job) {
+                    return status;
+                }
+                var data = new FormData(form);
+                data.delete('file');
+                data.append('filename', file.name);
+                data.append('size', file.size);
+                return fetch('/uploads', {method: 'POST', body: data}).then(function (resp) {
+                    if (!resp.ok) {
+                        return failed(resp);
+                    }
+                    return resp.json().then(function (status) {
+                        if (window.localStorage) {
+                            localStorage.setItem(key, status.id);
+                        }
+                        return status;
+                    });
+                });
+            });
+        }
+
+        // 逐块上传；网络错误或服务端繁忙时等待后查询已确认的偏移量再继续
+        function sendChunks(file, status, retries) {
+            if (status.job) {
+                return Promise.resolve(status.job);
+            }
+            if (status.complete) {
+                return fetch('/uploads/' + status.id + '/job', {method: 'POST'}).then(function (resp) {
+                    if (resp.status === 429 || resp.status === 503) {
+                        progress.textContent = '服务繁忙，稍后自动重试...';
+                        return sleep(retryDelay(resp)).then(function () { return sendChunks(file, status, retries); });
+                    }
+                    return resp.ok ? resp.json() : failed(resp);
+                });
+            }
+            progress.textContent = '正在上传 ' + Math.floor(status.offset * 100 / status.size) + '%...';
+            var chunk = file.slice(status.offset, status.offset + status.chunk_size);
+            return chunk.arrayBuffer().then(function (buffer) {
+                return fetch('/uploads/' + status.id + '?offset=' + status.offset, {
+                    method: 'PUT',
+                    headers: {'X-Chunk-CRC32': crc32(new Uint8Array(buffer))},
+                    body: buffer
+                });
+            }).then(function (resp) {
+                if (resp.ok || resp.status === 409) {
+                    return resp.json().then(function (next) { return sendChunks(file, next, 0); });
+                }
+                if (retries >= MAX_RETRIES || (resp.status !== 400 && resp.status < 429)) {
+                    return failed(resp);
+                }
+                return sleep(retryDelay(resp)).then(function () { return resume(file, status, retries + 1); });
+            }, function () {
+                if (retries >= MAX_RETRIES) {
+                    throw new Error('网络连接中断，上传失败');
+                }
+                progress.textContent = '网络连接中断，正在重试...';
+                return sleep(2000).then(function () { return resume(file, status, retries + 1); });
+            });
+        }
+        function resume(file, status, retries) {
+            return fetch('/uploads/' + status.id).then(function (resp) {
+                return resp.ok ? resp.json() : failed(resp);
+            }).then(function (next) {
+                return sendChunks(file, next, retries);
+            }, function () {
+                if (retries >= MAX_RETRIES) {
+                    throw new Error('网络连接中断，上传失败');
+                }
+                return sleep(2000).then(function () { return resume(file, status, retries + 1); });
+            });
+        }
+
+        if (window.EventSource && window.fetch && window.Promise && Blob.prototype.arrayBuffer) {
+            form.addEventListener('submit', function (e) {
+                e.preventDefault();
+                var file = form.elements.file.files[0];
+                progress.textContent = '正在上传...';
+                startUpload(file)
+                    .then(function (status) { return sendChunks(file, status, 0); })
+                    .then(function (job) {
+                        var source = new EventSource(job.events);
+                        source.onmessage = function (msg) {
+                            var event = JSON.parse(msg.data);
+                            if (event.stage === 'slide') {
+                                progress.textContent = '正在处理第 ' + event.page + '/' + event.total + ' 页...';
+                            } else if (event.stage === 'finished') {
+                                source.close();
+                                progress.textContent = '转换完成';
+                                window.location = job.result;
+                            } else if (event.stage === 'error') {
+                                source.close();
+                                progress.textContent = '转换过程中发生错误: ' + event.error;
+                            } else if (STAGES[event.stage]) {
+                                progress.textContent = STAGES[event.stage];
+                            }
+                        };
+                    })
+                    .catch(function (err) {
+                        progress.textContent = err.message;
+                    });
+            });
+        }
+    </script>
 </body>
 </html>
 '''
 
+@app.before_request
+def reload_rules():
+    """规则文件修改后自动生效，无需重启服务"""
+    rules.reload_if_changed()
+
+@app.before_request
+def mark_request_start():
+    """记录请求开始时间，追踪中的上传区间从这里算起（上传内容在首次访问 request.files 时才读取）"""
+    g.request_started = time.time()
+
+def _index_upload(pptx_path, upload_id, record):
+    """转换成功后写入检索索引；索引失败只记录日志，不影响返回结果
+
+    索引键为 upload/<上传id>/<文件名>，不同上传的同名文件各自保留一条记录
+    """
+    if not INDEX_DB:
+        return
+    try:
+        corpus.index_conversion(INDEX_DB, pptx_path, record,
+                                key=f'upload/{upload_id}/{os.path.basename(pptx_path)}')
+    except Exception as e:
+        app.logger.error(f'写入检索索引失败: {e}')
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：预热完成前返回 503"""
+    if not _ready:
+        return jsonify({'ready': False}), 503
+    return jsonify({'ready': True})
+
+@app.errorhandler(admission.Rejected)
+def rejected(e):
+    """繁忙时快速拒绝，并告知客户端何时重试"""
+    return str(e), e.status, {'Retry-After': str(e.retry_after)}
+
+class PreflightRejected(Exception):
+    """上传的文件不像拍摄需求模板，未进行转换"""
+
+    def __init__(self, result):
+        super().__init__(result.get('error') or '未识别到拍摄需求模板页面（产品信息/产品卖点/参考风格/拍摄思路）')
+        self.result = result
+
+    def __reduce__(self):
+        # 批量转换时在子进程中抛出，需要能按原参数重建
+        return (PreflightRejected, (self.result,))
+
+@app.errorhandler(PreflightRejected)
+def preflight_rejected(e):
+    return jsonify({'error': str(e), 'preflight': e.result}), 422
+
+def _preflight(pptx_path):
+    """模板预检（只读zip目录和幻灯片文字），置信度低于 PREFLIGHT_MIN_CONFIDENCE 时抛出 PreflightRejected"""
+    try:
+        result = script_generator.preflight(pptx_path)
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise PreflightRejected({'confidence': 0.0, 'error': f'不是有效的PPTX文件: {e}'})
+    if result['confidence'] < PREFLIGHT_MIN_CONFIDENCE:
+        raise PreflightRejected(result)
+    return result
+
+@app.route('/metrics')
+def metrics():
+    """导出同步转换、异步任务和批量转换各接纳队列的深度、等待时间和拒绝次数（Prometheus 文本格式）"""
+    return Response(conversion_queue.metrics() + background_queue.metrics('background_conversion')
+                    + batch_queue.metrics('batch_conversion'),
+                    mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 @app.route('/convert', methods=['POST'])
 def convert():
+    conversion_queue.check()
     if 'file' not in request.files:
         return '没有上传文件', 400
     
@@ -69,33 +418,653 @@ def convert():
     if not file.filename.endswith('.pptx'):
         return '请上传.pptx文件', 400
 
+    fmt = request.form.get('format', 'pdf')
+    if fmt not in RENDERERS:
+        return f'不支持的输出格式: {fmt}', 400
+    pdf_profile = request.form.get('pdf_profile') or None
+    if pdf_profile and pdf_profile not in PDF_PROFILES:
+        return f'不支持的PDF档位: {pdf_profile}', 400
+
+    tracer = tracing.start_trace(file.filename)
+    try:
+        return _convert_upload(file, fmt, pdf_profile, tracer)
+    finally:
+        tracer.finish()
+
+def _convert_upload(file, fmt, pdf_profile, tracer):
+    """同步转换上传的文件并返回结果"""
     # 创建临时目录存储文件
     with tempfile.TemporaryDirectory() as temp_dir:
-        # 保存上传的文件
+        # 保存上传的文件，先做模板预检，再排队等到执行名额后开始转换
         pptx_path = os.path.join(temp_dir, file.filename)
         file.save(pptx_path)
+        tracer.add_span("upload", g.request_started, time.time())
+        with tracer.span("preflight"):
+            checked = _preflight(pptx_path)
         
-        # 初始化转换器
-        generator = ScriptGenerator()
+        queued = time.time()
+        with conversion_queue.admit():
+            tracer.add_span("queue_wait", queued, time.time())
+            # 初始化转换器
+            register_font()
+            generator = ScriptGenerator()
         
-        try:
-            # 生成PDF文件名
-            pdf_filename = os.path.splitext(file.filename)[0] + '_拍摄需求.pdf'
-            pdf_path = os.path.join(temp_dir, pdf_filename)
+            try:
+                # 处理文件
+                profile_id = None
+                if PROFILE_REQUESTS and request.headers.get('X-Profile') == '1':
+                    os.makedirs(PROFILE_DIR, exist_ok=True)
+                    profile_id = uuid.uuid4().hex
+                    profile_base = os.path.join(PROFILE_DIR, profile_id)
+                    outputs = profile_call(profile_base, generator.process_file, pptx_path, formats=(fmt,),
+                                           pdf_profile=pdf_profile, tracer=tracer)
+                else:
+                    outputs = generator.process_file(pptx_path, formats=(fmt,), pdf_profile=pdf_profile,
+                                                     tracer=tracer)
+                output_path = outputs[fmt]
+                _index_upload(pptx_path, uuid.uuid4().hex, generator.to_dict())
             
-            # 处理文件
-            generator.process_file(pptx_path)
+                # 返回生成的文件
+                response = send_file(
+                    output_path,
+                    as_attachment=True,
+                    download_name=os.path.basename(output_path),
+                    mimetype=MIMETYPES.get(fmt, 'application/octet-stream')
+                )
+                response.headers['X-Preflight-Confidence'] = str(checked['confidence'])
+                if profile_id:
+                    # 只返回 id，不暴露服务器上的路径
+                    response.headers['X-Profile-Id'] = profile_id
+                return response
             
-            # 返回生成的PDF文件
-            return send_file(
-                pdf_path,
-                as_attachment=True,
-                download_name=pdf_filename,
-                mimetype='application/pdf'
-            )
-            
-        except Exception as e:
-            return f'转换过程中发生错误: {str(e)}', 500
+            except Exception as e:
+                return f'转换过程中发生错误: {str(e)}', 500
+
+def _job_dir(job_id):
+    """返回任务目录，任务 ID 不合法时返回 None"""
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    return os.path.join(JOBS_DIR, job_id)
+
+def _append_event(job_dir, event):
+    """追加一条进度事件（JSON Lines）"""
+    with open(os.path.join(job_dir, 'events.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+def _read_events(job_dir):
+    """读取任务已产生的全部事件"""
+    with open(os.path.join(job_dir, 'events.jsonl'), encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.endswith('\n')]
+
+def _heartbeat_loop():
+    """心跳线程：定时更新本进程所有未结束任务的 heartbeat 文件"""
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        with _active_jobs_lock:
+            job_dirs = list(_active_jobs)
+        for job_dir in job_dirs:
+            try:
+                os.utime(os.path.join(job_dir, 'heartbeat'))
+            except OSError:
+                pass
+
+def _register_job(job_dir):
+    """记录任务由本进程执行（写入进程号），并确保心跳线程已启动"""
+    global _heartbeat_thread
+    with open(os.path.join(job_dir, 'heartbeat'), 'w') as f:
+        f.write(str(os.getpid()))
+    with _active_jobs_lock:
+        _active_jobs.add(job_dir)
+        # gunicorn fork 出的 worker 不会继承主进程的线程，按需在本进程中启动
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, daemon=True)
+            _heartbeat_thread.start()
+
+def _unregister_job(job_dir):
+    with _active_jobs_lock:
+        _active_jobs.discard(job_dir)
+
+def _job_alive(job_dir):
+    """任务的执行进程是否仍在运行：心跳未过期且进程存在"""
+    path = os.path.join(job_dir, 'heartbeat')
+    try:
+        if time.time() - os.path.getmtime(path) > JOB_STALE_AFTER:
+            return False
+        with open(path) as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _prune_jobs():
+    """清理超过 JOB_TTL 的任务目录、上传目录和性能分析结果"""
+    cutoff = time.time() - JOB_TTL
+    for root in (JOBS_DIR, UPLOADS_DIR, PROFILE_DIR):
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+            except OSError:
+                pass
+
+def _run_job(job_dir, pptx_path, fmt, pdf_profile, ticket, tracer):
+    """后台线程：等待执行名额后执行转换，并把每个阶段写入事件文件"""
+    def on_progress(stage, current_page, total_pages):
+        _append_event(job_dir, {'stage': stage, 'page': current_page, 'total': total_pages})
+
+    queued = time.time()
+    try:
+        # 异步任务的调用方不阻塞，可以排队到任务过期为止
+        background_queue.wait(ticket, timeout=JOB_TTL)
+    except admission.Rejected as e:
+        _append_event(job_dir, {'stage': 'error', 'error': str(e)})
+        _unregister_job(job_dir)
+        tracer.add_span("queue_wait", queued, time.time(), error="Rejected")
+        tracer.finish()
+        return
+    tracer.add_span("queue_wait", queued, time.time())
+
+    started = time.monotonic()
+    try:
+        register_font()
+        generator = ScriptGenerator()
+        outputs = generator.process_file(pptx_path, progress_callback=on_progress, formats=(fmt,),
+                                         pdf_profile=pdf_profile, tracer=tracer)
+        _index_upload(pptx_path, os.path.basename(job_dir), generator.to_dict())
+        _append_event(job_dir, {'stage': 'finished', 'format': fmt, 'output': os.path.basename(outputs[fmt]),
+                                'stats': generator.stats.get('outputs', {}).get(fmt)})
+    except Exception as e:
+        _append_event(job_dir, {'stage': 'error', 'error': str(e)})
+    finally:
+        _unregister_job(job_dir)
+        background_queue.release(started)
+        tracer.finish()
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """上传文件并在后台转换，返回进度事件流和结果下载地址；等待队列已满时返回 429"""
+    background_queue.check()
+    if 'file' not in request.files:
+        return '没有上传文件', 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return '没有选择文件', 400
+    
+    if not file.filename.endswith('.pptx'):
+        return '请上传.pptx文件', 400
+
+    fmt = request.form.get('format', 'pdf')
+    if fmt not in RENDERERS:
+        return f'不支持的输出格式: {fmt}', 400
+    pdf_profile = request.form.get('pdf_profile') or None
+    if pdf_profile and pdf_profile not in PDF_PROFILES:
+        return f'不支持的PDF档位: {pdf_profile}', 400
+
+    _prune_jobs()
+    return _start_job(file.save, file.filename, fmt, pdf_profile, g.request_started), 202
+
+def _start_job(save, filename, fmt, pdf_profile, upload_started, checked=None):
+    """创建任务目录，用 save(路径) 写入PPTX后在后台转换，返回任务信息；等待队列已满时抛出 Rejected
+
+    upload_started 为上传开始的时间（time.time()），记入追踪的上传区间；
+    checked 为调用方已做过的预检结果，未提供时在写入后预检
+    """
+    tracer = tracing.start_trace(filename)
+    ticket = background_queue.reserve()
+    try:
+        job_id = uuid.uuid4().hex
+        job_dir = _job_dir(job_id)
+        os.makedirs(job_dir)
+        pptx_path = os.path.join(job_dir, os.path.basename(filename))
+        save(pptx_path)
+        tracer.add_span("upload", upload_started, time.time())
+        if checked is None:
+            with tracer.span("preflight"):
+                checked = _preflight(pptx_path)
+        _append_event(job_dir, {'stage': 'queued', 'queue_depth': background_queue.waiting})
+        _register_job(job_dir)
+    except Exception:
+        _unregister_job(job_dir)
+        background_queue.cancel(ticket)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        tracer.finish()
+        raise
+
+    threading.Thread(target=_run_job, args=(job_dir, pptx_path, fmt, pdf_profile, ticket, tracer),
+                     daemon=True).start()
+    return {
+        'id': job_id,
+        'events': f'/jobs/{job_id}/events',
+        'result': f'/jobs/{job_id}/result',
+        'preflight': checked,
+    }
+
+def _upload_dir(upload_id):
+    """返回上传目录，上传 ID 不合法时返回 None"""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        return None
+    return os.path.join(UPLOADS_DIR, upload_id)
+
+def _read_upload(upload_dir):
+    """读取上传信息，并附上已确认的偏移量（暂存文件当前大小）"""
+    with open(os.path.join(upload_dir, 'upload.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    data_path = os.path.join(upload_dir, 'data.part')
+    meta['offset'] = os.path.getsize(data_path) if os.path.exists(data_path) else meta['size']
+    return meta
+
+def _write_upload(upload_dir, meta):
+    """原子地写入上传信息"""
+    tmp_path = os.path.join(upload_dir, 'upload.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({k: v for k, v in meta.items() if k != 'offset'}, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(upload_dir, 'upload.json'))
+
+def _upload_status(upload_id, meta):
+    return {
+        'id': upload_id,
+        'offset': meta['offset'],
+        'size': meta['size'],
+        'chunk_size': UPLOAD_CHUNK_SIZE,
+        'complete': meta['offset'] >= meta['size'],
+        'job': meta.get('job'),
+    }
+
+def _start_upload_job(upload_dir, meta):
+    """上传完成后把暂存文件移入任务目录并开始转换；已开始过的直接返回原任务"""
+    if meta.get('job') is None:
+        data_path = os.path.join(upload_dir, 'data.part')
+        checked = _preflight(data_path)  # 未通过预检时保留暂存文件，不移入任务目录
+        meta['job'] = _start_job(lambda path: os.replace(data_path, path),
+                                 meta['filename'], meta['format'], meta['pdf_profile'], meta['created'], checked)
+        _write_upload(upload_dir, meta)
+    return meta['job']
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """开始分块上传：提交文件名、总大小和转换参数，返回上传 ID 与建议的块大小"""
+    filename = os.path.basename(request.form.get('filename', ''))
+    if not filename.endswith('.pptx'):
+        return '请上传.pptx文件', 400
+    size = request.form.get('size', type=int)
+    if size is None or size <= 0:
+        return '缺少文件大小', 400
+    if size > UPLOAD_MAX_SIZE:
+        return f'文件过大，最大 {UPLOAD_MAX_SIZE // (1024 * 1024)} MB', 413
+
+    fmt = request.form.get('format', 'pdf')
+    if fmt not in RENDERERS:
+        return f'不支持的输出格式: {fmt}', 400
+    pdf_profile = request.form.get('pdf_profile') or None
+    if pdf_profile and pdf_profile not in PDF_PROFILES:
+        return f'不支持的PDF档位: {pdf_profile}', 400
+
+    _prune_jobs()
+    upload_id = uuid.uuid4().hex
+    upload_dir = _upload_dir(upload_id)
+    os.makedirs(upload_dir)
+    open(os.path.join(upload_dir, 'data.part'), 'wb').close()
+    meta = {'filename': filename, 'size': size, 'format': fmt, 'pdf_profile': pdf_profile,
+            'created': g.request_started, 'job': None}
+    _write_upload(upload_dir, meta)
+    meta['offset'] = 0
+    return _upload_status(upload_id, meta), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """查询上传进度：offset 为服务端已确认写入的字节数，客户端从这里继续上传"""
+    upload_dir = _upload_dir(upload_id)
+    if not upload_dir or not os.path.isdir(upload_dir):
+        return '上传不存在', 404
+    return _upload_status(upload_id, _read_upload(upload_dir))
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """上传一块数据：?offset= 必须等于已确认的偏移量，X-Chunk-CRC32 为本块的 CRC32（十六进制）
+
+    偏移量不符时返回 409 和当前偏移量；校验失败时丢弃本块并返回 400；
+    最后一块写入后立即开始转换，响应中带有任务信息。
+    """
+    upload_dir = _upload_dir(upload_id)
+    if not upload_dir or not os.path.isdir(upload_dir):
+        return '上传不存在', 404
+    offset = request.args.get('offset', type=int)
+    expected_crc = request.headers.get('X-Chunk-CRC32', '')
+    if offset is None or not re.fullmatch(r'[0-9a-fA-F]{1,8}', expected_crc):
+        return '缺少 offset 参数或 X-Chunk-CRC32 头', 400
+
+    data_path = os.path.join(upload_dir, 'data.part')
+    lock_path = os.path.join(upload_dir, 'lock')
+    with open(lock_path, 'w') as lock:
+        # 同一上传的并发请求（如客户端超时重试）逐个处理，多个 gunicorn worker 之间同样有效
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        meta = _read_upload(upload_dir)
+        if meta['offset'] != offset:
+            return _upload_status(upload_id, meta), 409
+        if meta['offset'] >= meta['size']:
+            return _upload_status(upload_id, meta)
+
+        limit = min(UPLOAD_CHUNK_SIZE, meta['size'] - offset)
+        crc = 0
+        written = 0
+        with open(data_path, 'r+b') as f:
+            f.seek(offset)
+            while True:
+                block = request.stream.read(64 * 1024)
+                if not block:
+                    break
+                written += len(block)
+                if written > limit:
+                    break
+                crc = zlib.crc32(block, crc)
+                f.write(block)
+            if written > limit or written == 0 or crc != int(expected_crc, 16):
+                f.truncate(offset)
+                if written > limit:
+                    return f'数据块过大，最多 {limit} 字节', 413
+                return '数据块为空或校验失败，请重新上传该块', 400
+            f.flush()
+            os.fsync(f.fileno())
+        os.utime(upload_dir)
+        meta['offset'] = offset + written
+
+        if meta['offset'] >= meta['size']:
+            _start_upload_job(upload_dir, meta)
+    return _upload_status(upload_id, meta)
+
+@app.route('/uploads/<upload_id>/job', methods=['POST'])
+def upload_job(upload_id):
+    """为已完成的上传开始转换（最后一块写入时因繁忙被拒绝后，按 Retry-After 重试）"""
+    upload_dir = _upload_dir(upload_id)
+    if not upload_dir or not os.path.isdir(upload_dir):
+        return '上传不存在', 404
+    with open(os.path.join(upload_dir, 'lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        meta = _read_upload(upload_dir)
+        if meta['offset'] < meta['size']:
+            return _upload_status(upload_id, meta), 409
+        return _start_upload_job(upload_dir, meta), 202
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务进度，直到完成或出错
+
+    每条事件的 id 为其在事件文件中的结束偏移量；连接保持 SSE_MAX_DURATION 秒后结束，
+    浏览器重连时带上 Last-Event-ID，从该位置继续。执行任务的进程已退出时追加一条 error 事件并结束。
+    """
+    job_dir = _job_dir(job_id)
+    if not job_dir or not os.path.isdir(job_dir):
+        return '任务不存在', 404
+    events_path = os.path.join(job_dir, 'events.jsonl')
+    offset = request.headers.get('Last-Event-ID', 0, type=int)
+
+    def stream(offset):
+        last_sent = time.monotonic()
+        last_checked = float('-inf')  # 首次没有新事件时立即检查任务是否仍在执行
+        deadline = last_sent + SSE_MAX_DURATION
+        yield 'retry: 1000\n\n'
+        while time.monotonic() < deadline:
+            with open(events_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            # 只发送完整的行，写了一半的行留到下一轮
+            complete = data[:data.rfind(b'\n') + 1]
+            for line in complete.splitlines(keepends=True):
+                offset += len(line)
+                yield f'id: {offset}\ndata: {line.decode("utf-8").rstrip()}\n\n'
+                last_sent = time.monotonic()
+                if json.loads(line)['stage'] in ('finished', 'error'):
+                    return
+            now = time.monotonic()
+            if not complete and now - last_checked > JOB_HEARTBEAT_INTERVAL:
+                last_checked = now
+                if not _job_alive(job_dir):
+                    _append_event(job_dir, {'stage': 'error', 'error': '转换进程已退出（服务重启或处理超时），请重新提交'})
+                    continue
+            if now - last_sent > SSE_KEEPALIVE:
+                yield ': keepalive\n\n'
+                last_sent = now
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(
+        stream(offset),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """下载任务结果"""
+    job_dir = _job_dir(job_id)
+    if not job_dir or not os.path.isdir(job_dir):
+        return '任务不存在', 404
+
+    events = _read_events(job_dir)
+    last = events[-1] if events else {}
+    if last.get('stage') == 'error':
+        return f'转换过程中发生错误: {last["error"]}', 500
+    if last.get('stage') != 'finished':
+        return '任务尚未完成', 409
+
+    return send_file(
+        os.path.join(job_dir, last['output']),
+        as_attachment=True,
+        download_name=last['output'],
+        mimetype=MIMETYPES.get(last['format'], 'application/octet-stream')
+    )
+
+@app.route('/search')
+def search_index():
+    """检索已转换文件中的道具、布景、产品名称和卖点"""
+    if not INDEX_DB:
+        return '未配置检索索引（INDEX_DB）', 404
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return '缺少查询参数 q', 400
+
+    kind = request.args.get('kind')
+    if kind and kind not in search.KINDS:
+        return f'不支持的类型: {kind}', 400
+
+    conn = corpus.open_db(INDEX_DB)
+    try:
+        result = search.search(
+            conn, query,
+            kind=kind,
+            category=request.args.get('category'),
+            month=request.args.get('month'),
+            limit=min(request.args.get('limit', 50, type=int), 500)
+        )
+    finally:
+        conn.close()
+    return jsonify(result)
+
+def _get_batch_pool():
+    """获取批量转换进程池"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=_batch_mp_context)
+        return _batch_pool
+
+def _reset_batch_pool(pool):
+    """进程池损坏（如子进程崩溃）后丢弃，下次请求时重建
+
+    只丢弃出错的那个进程池：其他请求可能已换上新的进程池，不能把它关掉
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is pool:
+            _batch_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _convert_in_worker(pptx_path):
+    """在子进程中转换单个文件，返回生成的PDF路径；未通过模板预检时抛出异常，记入 manifest
+
+    子进程只返回路径，PDF数据不经过进程间序列化；临时图片也放在主进程所有的任务目录下，
+    子进程崩溃时随批量临时目录一并删除
+    """
+    rules.reload_if_changed()
+    _preflight(pptx_path)
+    register_font()
+    generator = ScriptGenerator()
+    generator.spool_root = os.path.dirname(pptx_path)
+    outputs = generator.process_file(pptx_path)
+    # 每个文件所在的子目录以 uuid 命名，用作上传id
+    _index_upload(pptx_path, os.path.basename(os.path.dirname(pptx_path)), generator.to_dict())
+    return outputs['pdf']
+
+class _ZipStream:
+    """只追加的写缓冲区，zipfile 将其视为不可 seek 的流，按块取出即可边压缩边发送"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """取出已写入的数据块（不合并，避免再复制一次）"""
+        chunks = self._chunks
+        self._chunks = []
+        return chunks
+
+def _zip_mapped_file(zf, stream, path, arcname):
+    """以内存映射方式把文件不压缩地写入ZIP并按块产出（PDF已压缩，再压缩收益很小）
+
+    数据从页缓存直接经 memoryview 交给 zipfile，只在放入发送缓冲区时复制一次
+    """
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, 'rb') as f, zf.open(info, 'w') as dst:
+        if info.file_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for offset in range(0, len(view), BATCH_CHUNK_SIZE):
+                with view[offset:offset + BATCH_CHUNK_SIZE] as chunk:
+                    dst.write(chunk)
+                yield from stream.drain()
+
+def _stream_batch_zip(temp_dir, jobs):
+    """并发转换并按完成顺序输出ZIP，最后附加 manifest.json 记录每个文件的结果
+
+    某个子进程崩溃时共享进程池中未完成的任务会全部失败，无法确定是哪个文件导致的：这些文件各自在单独的
+    进程中重试一次，只有单独运行仍然崩溃的文件记为失败。客户端断开时取消尚未开始的任务，
+    并等执行中的子进程结束后再删除临时目录，随后才释放执行名额
+    """
+    stream = _ZipStream()
+    manifest = []
+    used_names = set()
+    # future -> (文件名, 路径, 单独重试时专用的进程池，共享进程池中的任务为 None)
+    pending = {}
+    retries = []
+    try:
+        pool = _get_batch_pool()
+        for name, pptx_path in jobs:
+            pending[pool.submit(_convert_in_worker, pptx_path)] = (name, pptx_path, None)
+        with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            while pending or retries:
+                # 单独重试的任务最多同时运行 BATCH_WORKERS 个
+                while retries and sum(1 for *_, own in pending.values() if own) < BATCH_WORKERS:
+                    name, pptx_path = retries.pop(0)
+                    own = ProcessPoolExecutor(max_workers=1, mp_context=_batch_mp_context)
+                    pending[own.submit(_convert_in_worker, pptx_path)] = (name, pptx_path, own)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, pptx_path, own = pending.pop(future)
+                    if own:
+                        own.shutdown(wait=False)
+                    try:
+                        pdf_path = future.result()
+                        base_name = os.path.splitext(name)[0] + '_拍摄需求.pdf'
+                        pdf_name = base_name
+                        # 加序号直到不与已有文件重名（上传的文件名本身也可能带序号前缀）
+                        suffix = 1
+                        while pdf_name in used_names:
+                            pdf_name = f'{suffix}_{base_name}'
+                            suffix += 1
+                        used_names.add(pdf_name)
+                        yield from _zip_mapped_file(zf, stream, pdf_path, pdf_name)
+                        manifest.append({'file': name, 'status': 'ok', 'output': pdf_name})
+                    except BrokenProcessPool as e:
+                        if own is None:
+                            _reset_batch_pool(pool)
+                            retries.append((name, pptx_path))
+                        else:
+                            manifest.append({'file': name, 'status': 'error', 'error': f'转换进程异常退出: {e}'})
+                    except Exception as e:
+                        manifest.append({'file': name, 'status': 'error', 'error': str(e)})
+                    yield from stream.drain()
+            zf.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+        yield from stream.drain()
+    finally:
+        for future in pending:
+            future.cancel()
+        # 执行中的子进程无法取消，等它们结束后再删除输入文件
+        wait(pending)
+        for *_, own in pending.values():
+            if own:
+                own.shutdown(wait=False)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@app.route('/convert_batch', methods=['POST'])
+def convert_batch():
+    batch_queue.check()
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return '没有上传文件', 400
+
+    if len(files) > BATCH_MAX_FILES:
+        return f'单次最多上传 {BATCH_MAX_FILES} 个文件', 400
+
+    for file in files:
+        if not file.filename.endswith('.pptx'):
+            return f'请上传.pptx文件: {file.filename}', 400
+
+    # 整个批量请求占用一个执行名额，直到ZIP发送完毕（或客户端断开）才释放
+    started = batch_queue.acquire()
+    try:
+        # 每个文件放在以 uuid 命名的独立子目录，避免同名文件互相覆盖，子目录名也是写入索引的上传id；
+        # 子进程的输出和临时图片都在该目录下，发送完毕（包括子进程崩溃、客户端断开）后统一删除
+        temp_dir = tempfile.mkdtemp(prefix='script_batch_')
+        jobs = []
+        for file in files:
+            name = os.path.basename(file.filename)
+            job_dir = os.path.join(temp_dir, uuid.uuid4().hex)
+            os.makedirs(job_dir)
+            pptx_path = os.path.join(job_dir, name)
+            file.save(pptx_path)
+            jobs.append((name, pptx_path))
+    except Exception:
+        batch_queue.release(started)
+        raise
+
+    response = Response(
+        _stream_batch_zip(temp_dir, jobs),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="batch_output.zip"'}
+    )
+    response.call_on_close(lambda: batch_queue.release(started))
+    return response
 
 if __name__ == '__main__':
+    warm_up()
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080))) 
\ No newline at end of file
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from script_generator import ScriptGenerator, register_font
+import search
+
+# 数据库结构：每个PPTX一行 decks，卖点/布景/道具按条目展开，便于查询
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    product_name TEXT,
+    product_link TEXT,
+    has_main_image INTEGER,
+    reference_images INTEGER,
+    outputs TEXT,
+    converted_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS selling_points (
+    deck_id INTEGER NOT NULL REFERENCES decks(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    deck_id INTEGER NOT NULL REFERENCES decks(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS props (
+    deck_id INTEGER NOT NULL REFERENCES decks(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_selling_points_deck ON selling_points(deck_id);
+CREATE INDEX IF NOT EXISTS idx_scenes_deck ON scenes(deck_id);
+CREATE INDEX IF NOT EXISTS idx_props_deck ON props(deck_id);
+CREATE INDEX IF NOT EXISTS idx_props_text ON props(text);
+"""
+
+# 每提交一次事务写入的文件数
+COMMIT_EVERY = 50
+
+def is_lock_file(name):
+    """判断是否为编辑器锁文件或临时文件（如 .~xxx.pptx、~$xxx.pptx）"""
+    return name.startswith((".", "~$")) or name.endswith(".tmp")
+
+def find_decks(root):
+    """递归查找目录下的PPTX文件，跳过隐藏目录、锁文件和空文件"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in sorted(filenames):
+            if not name.lower().endswith(".pptx") or is_lock_file(name):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                if os.path.getsize(path) == 0:
+                    continue
+            except OSError:
+                continue
+            yield path
+
+def open_db(db_path):
+    """打开（必要时创建）索引数据库"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    conn.executescript(search.SCHEMA)
+    return conn
+
+def _extract_deck(path, formats, spool_root=None):
+    """在子进程中处理单个文件，返回可序列化的提取结果（输出文件只返回路径）"""
+    generator = ScriptGenerator()
+    generator.spool_root = spool_root
+    outputs = generator.process_file(path, formats=formats)
+    return generator.to_dict(), outputs, generator.stats
+
+def save_record(conn, path, stat, record=None, outputs=None, error=None):
+    """写入（或替换）一个文件的提取结果"""
+    conn.execute("DELETE FROM decks WHERE path = ?", (path,))
+    if record is None:
+        conn.execute(
+            "INSERT INTO decks (path, name, size, mtime, status, error, converted_at) "
+            "VALUES (?, ?, ?, ?, 'error', ?, ?)",
+            (path, os.path.basename(path), stat.st_size, stat.st_mtime, error, time.time())
+        )
+        return
+
+    cursor = conn.execute(
+        "INSERT INTO decks (path, name, size, mtime, status, product_name, product_link, "
+        "has_main_image, reference_images, outputs, converted_at) "
+        "VALUES (?, ?, ?, ?, 'ok', ?, ?, ?, ?, ?, ?)",
+        (path, os.path.basename(path), stat.st_size, stat.st_mtime,
+         record["产品信息"]["名称"], record["产品信息"]["链接"], int(record["产品信息"]["主图"]),
+         record["参考风格"], json.dumps(outputs or {}, ensure_ascii=False), time.time())
+    )
+    deck_id = cursor.lastrowid
+    conn.executemany(
+        "INSERT INTO selling_points (deck_id, position, text) VALUES (?, ?, ?)",
+        [(deck_id, i, point) for i, point in enumerate(record["产品卖点"])]
+    )
+    conn.executemany(
+        "INSERT INTO scenes (deck_id, category, text) VALUES (?, ?, ?)",
+        [(deck_id, category, scene) for category, scenes in record["布景"].items() for scene in scenes]
+    )
+    conn.executemany(
+        "INSERT INTO props (deck_id, category, text) VALUES (?, ?, ?)",
+        [(deck_id, category, prop) for category, props in record["道具"].items() for prop in props]
+    )
+    search.index_record(conn, deck_id, record)
+
+def index_conversion(db_path, path, record, outputs=None, key=None):
+    """把单次转换（如Web上传）的结果增量写入索引，key 为索引中记录的路径（默认即 path）"""
+    conn = open_db(db_path)
+    try:
+        save_record(conn, key or path, os.stat(path), record=record, outputs=outputs)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _is_unchanged(conn, path, stat):
+    """文件大小和修改时间与上次成功处理时一致"""
+    row = conn.execute(
+        "SELECT size, mtime FROM decks WHERE path = ? AND status = 'ok'", (path,)
+    ).fetchone()
+    return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime
+
+def _init_worker(formats):
+    """子进程初始化：需要生成PDF时注册字体"""
+    if "pdf" in formats:
+        register_font()
+
+def convert_corpus(root, db_path, jobs=None, formats=(), force=False):
+    """递归处理目录树中的PPTX文件，并行提取后写入SQLite，返回各状态的计数"""
+    conn = open_db(db_path)
+    summary = {"ok": 0, "error": 0, "skipped": 0, "text_cache_hits": 0, "text_cache_misses": 0}
+    formats = tuple(formats)
+
+    # 未修改的文件直接跳过，支持中断后继续
+    pending = {}
+    for path in find_decks(root):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if not force and _is_unchanged(conn, path, stat):
+            summary["skipped"] += 1
+            continue
+        pending[path] = stat
+    logging.info(f"待处理文件: {len(pending)}，跳过未修改文件: {summary['skipped']}")
+
+    # 子进程的临时图片目录建在这里，子进程崩溃时也会在结束后统一删除
+    spool_root = tempfile.mkdtemp(prefix="script_corpus_")
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(formats,)) as pool:
+            futures = {pool.submit(_extract_deck, path, formats, spool_root): path for path in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                path = futures[future]
+                try:
+                    record, outputs, stats = future.result()
+                    save_record(conn, path, pending[path], record=record, outputs=outputs)
+                    summary["ok"] += 1
+                    summary["text_cache_hits"] += stats.get("text_cache_hits", 0)
+                    summary["text_cache_misses"] += stats.get("text_cache_misses", 0)
+                except Exception as e:
+                    logging.error(f"处理文件 {path} 时发生错误: {e}")
+                    save_record(conn, path, pending[path], error=str(e))
+                    summary["error"] += 1
+                if done % COMMIT_EVERY == 0:
+                    conn.commit()
+                    print(f"已处理 {done}/{len(pending)}")
+        conn.commit()
+    finally:
+        conn.close()
+        shutil.rmtree(spool_root, ignore_errors=True)
+    return summary
@@ -3,17 +3,17 @@
 
 import os
 import sys
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from script_generator import ScriptGenerator
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from script_generator import ScriptGenerator, ConversionCancelled, register_font
 
 class App:
     def __init__(self, root):
         self.root = root
         self.root.title("拍摄脚本处理程序")
-        self.root.geometry("500x300")
+        self.root.geometry("500x480")
         
         # 设置窗口样式
         style = ttk.Style()
@@ -28,18 +28,35 @@ class App:
         title_label = ttk.Label(main_frame, text="拍摄脚本处理程序", font=("STHeiti", 24))
         title_label.pack(pady=20)
         
+        # 创建按钮栏
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(pady=10)
+        
         # 创建上传按钮
         self.upload_button = ttk.Button(
-            main_frame,
+            button_frame,
             text="选择PPTX文件",
             command=self.select_file,
             style="Upload.TButton"
         )
-        self.upload_button.pack(pady=20)
+        self.upload_button.pack(side=tk.LEFT, padx=5)
+        
+        # 创建取消按钮
+        self.cancel_button = ttk.Button(
+            button_frame,
+            text="取消",
+            command=self.cancel,
+            state=tk.DISABLED
+        )
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
         
         # 创建文件名标签
         self.file_label = ttk.Label(main_frame, text="未选择文件")
-        self.file_label.pack(pady=10)
+        self.file_label.pack(pady=5)
+        
+        # 创建待处理文件列表
+        self.queue_list = tk.Listbox(main_frame, height=5, width=50)
+        self.queue_list.pack(pady=5)
         
         # 创建进度条
         self.progress = ttk.Progressbar(main_frame, length=300, mode='determinate')
@@ -49,8 +66,13 @@ class App:
         self.status_label = ttk.Label(main_frame, text="就绪")
         self.status_label.pack(pady=10)
         
-        # 存储选择的文件
-        self.selected_file = None
+        # 待处理文件队列，以及后台线程发往界面的事件队列
+        self.pending_files = queue.Queue()
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+        self.busy = False
+        self.results = []
         
         # 自定义按钮样式
         style.configure(
@@ -60,59 +82,136 @@ class App:
         )
 
     def select_file(self):
-        """选择PPTX文件"""
-        file = filedialog.askopenfilename(
+        """选择PPTX文件（可多选），加入处理队列"""
+        files = filedialog.askopenfilenames(
             title="选择PPTX文件",
             filetypes=[("PowerPoint文件", "*.pptx")]
         )
-        if file:
-            self.selected_file = file
-            self.file_label['text'] = os.path.basename(file)
-            self.status_label['text'] = "就绪"
-            self.progress['value'] = 0
-            self.process_file()
+        for file in files:
+            self.pending_files.put(file)
+            self.queue_list.insert(tk.END, os.path.basename(file))
+        
+        if files and not self.busy:
+            self.start_worker()
 
-    def process_file(self):
-        """处理选中的文件"""
-        if not self.selected_file:
-            return
-            
+    def start_worker(self):
+        """启动后台处理线程，并开始轮询事件"""
+        self.busy = True
+        self.cancel_event.clear()
+        self.results = []
+        self.cancel_button['state'] = tk.NORMAL
+        self.status_label['text'] = "就绪"
+        self.progress['value'] = 0
+        self.worker = threading.Thread(target=self.run_queue, daemon=True)
+        self.worker.start()
+        self.root.after(100, self.poll_events)
+
+    def cancel(self):
+        """取消当前文件并清空队列"""
+        self.cancel_event.set()
+        self.status_label['text'] = "正在取消..."
+
+    def run_queue(self):
+        """后台线程：依次处理队列中的文件"""
+        while not self.cancel_event.is_set():
+            try:
+                file = self.pending_files.get_nowait()
+            except queue.Empty:
+                break
+            self.process_file(file)
+        
+        # 取消时丢弃剩余文件
+        while not self.pending_files.empty():
+            file = self.pending_files.get_nowait()
+            self.events.put(("skipped", file, None))
+        self.events.put(("finished", None, None))
+
+    def process_file(self, file):
+        """在后台线程中处理单个文件，进度通过事件队列发送给界面"""
+        def on_progress(stage, current_page, total_pages):
+            if self.cancel_event.is_set():
+                raise ConversionCancelled()
+            self.events.put(("progress", file, (stage, current_page, total_pages)))
+        
+        self.events.put(("start", file, None))
         try:
             # 注册字体
-            font_path = "/System/Library/Fonts/STHeiti Light.ttc"
-            pdfmetrics.registerFont(TTFont("STHeiti", font_path))
+            register_font()
             
-            # 创建生成器实例
+            # 创建生成器实例并处理文件
             generator = ScriptGenerator()
+            generator.process_file(file, progress_callback=on_progress)
             
-            # 更新状态
-            self.status_label['text'] = f"正在处理: {os.path.basename(self.selected_file)}"
-            self.progress['value'] = 20
-            self.root.update()
-            
-            # 处理文件
-            generator.process_file(self.selected_file)
-            
-            # 更新进度
-            self.progress['value'] = 100
-            self.status_label['text'] = "处理完成！"
-            self.root.update()
-            
-            # 显示完成消息
-            output_file = os.path.splitext(self.selected_file)[0] + "_拍摄需求.pdf"
-            messagebox.showinfo(
-                "完成",
-                f"文件处理完成！\n\n生成的PDF文件：\n{os.path.basename(output_file)}"
-            )
-            
-            # 重置状态
-            self.selected_file = None
-            self.file_label['text'] = "未选择文件"
-            
+            output_file = os.path.splitext(file)[0] + "_拍摄需求.pdf"
+            self.events.put(("done", file, output_file))
+        except ConversionCancelled:
+            self.events.put(("cancelled", file, None))
         except Exception as e:
-            messagebox.showerror("错误", f"处理文件时发生错误：\n{str(e)}")
-            self.status_label['text'] = "处理出错"
+            self.events.put(("error", file, str(e)))
+
+    def poll_events(self):
+        """在主线程中处理后台事件并更新界面"""
+        finished = False
+        while True:
+            try:
+                kind, file, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            
+            name = os.path.basename(file) if file else ""
+            if kind == "start":
+                self.file_label['text'] = name
+                self.status_label['text'] = f"正在处理: {name}"
+                self.progress['value'] = 0
+                if self.queue_list.size():
+                    self.queue_list.delete(0)
+            elif kind == "progress":
+                stage, current_page, total_pages = payload
+                if stage == "slide" and total_pages:
+                    self.progress['value'] = 90 * current_page / total_pages
+                    self.status_label['text'] = f"正在处理: {name}（第 {current_page}/{total_pages} 页）"
+                elif stage == "pdf":
+                    self.progress['value'] = 95
+                    self.status_label['text'] = f"正在生成PDF: {name}"
+            elif kind == "done":
+                self.progress['value'] = 100
+                self.results.append(f"✓ {os.path.basename(payload)}")
+            elif kind == "error":
+                self.results.append(f"✗ {name}: {payload}")
+            elif kind in ("cancelled", "skipped"):
+                self.results.append(f"- {name}: 已取消")
+            elif kind == "finished":
+                finished = True
+        
+        if not finished:
+            self.root.after(100, self.poll_events)
+            return
+        
+        # 线程退出后又有新文件加入时继续处理
+        if not self.cancel_event.is_set() and not self.pending_files.empty():
+            self.worker = threading.Thread(target=self.run_queue, daemon=True)
+            self.worker.start()
+            self.root.after(100, self.poll_events)
+            return
+        
+        # 队列处理完成，重置状态
+        self.busy = False
+        self.queue_list.delete(0, tk.END)
+        self.cancel_button['state'] = tk.DISABLED
+        self.file_label['text'] = "未选择文件"
+        if self.cancel_event.is_set():
+            self.status_label['text'] = "已取消"
             self.progress['value'] = 0
+        elif any(line.startswith("✗") for line in self.results):
+            self.status_label['text'] = "处理出错"
+        else:
+            self.status_label['text'] = "处理完成！"
+        
+        summary = "\n".join(self.results)
+        if any(line.startswith("✗") for line in self.results):
+            messagebox.showerror("错误", f"部分文件处理时发生错误：\n\n{summary}")
+        else:
+            messagebox.showinfo("完成", f"文件处理完成！\n\n生成的PDF文件：\n{summary}")
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,43 @@
+# gunicorn 配置：gunicorn -c gunicorn.conf.py app:app
+import gc
+import os
+
+# 线程数按应用的接纳上限推算；preload_app 下主进程本来就会导入应用
+import app
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# 线程 worker：每个请求（包括 SSE 进度流，最长 SSE_MAX_DURATION 秒）都占用一个线程直到结束。
+# 线程数默认按接纳控制的上限推算：执行中和排队中的同步转换、批量转换各占一个线程，再加上预计同时打开的
+# 进度流（GUNICORN_SSE_THREADS）和少量处理上传分块等短请求的线程；线程少于该值时请求会在 gunicorn
+# 的连接积压中等待，接纳队列的 429/Retry-After 无法生效
+worker_class = 'gthread'
+SSE_THREADS = int(os.environ.get('GUNICORN_SSE_THREADS', 16))
+SPARE_THREADS = 4
+threads = int(os.environ.get('GUNICORN_THREADS', 0)) or (
+    app.MAX_CONCURRENT_CONVERSIONS + app.MAX_QUEUED_CONVERSIONS
+    + app.MAX_CONCURRENT_BATCHES + app.MAX_QUEUED_BATCHES
+    + SSE_THREADS + SPARE_THREADS
+)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+# 按请求数回收 worker 默认关闭：异步任务（/jobs、分块上传）在 worker 内的后台线程中执行，
+# 回收会中断正在进行的转换（事件流随后报告“转换进程已退出”）；确需开启时设置 GUNICORN_MAX_REQUESTS
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = 50 if max_requests else 0
+
+# 在主进程中导入应用，fork 后 worker 通过写时复制共享已加载的模块
+preload_app = True
+
+
+def when_ready(server):
+    """主进程 fork worker 之前预热：字体、样式、规则等只加载一次"""
+    app.warm_up()
+    # 冻结现有对象，避免 worker 中的 GC 触碰这些页面而破坏写时复制
+    gc.freeze()
+    server.log.info("预热完成，开始启动 worker")
+
+
+def post_worker_init(worker):
+    """未启用 preload 时，每个 worker 自行预热"""
+    if not app.is_ready():
+        app.warm_up()
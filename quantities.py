@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+from collections import namedtuple
+
+# 中文数字（“两”只在后接量词时出现，如“两个”）
+CHINESE_NUMERALS = "零一二两三四五六七八九十百千万亿"
+
+# 量词与计量单位：中文数字只有后接这些词时才视为数量，避免“一起”“万圣节”中的单字被高亮
+CLASSIFIERS = (
+    "个", "只", "件", "张", "把", "根", "条", "支", "枝", "盆", "束", "朵", "片", "颗", "粒",
+    "块", "套", "组", "对", "双", "瓶", "罐", "盒", "包", "袋", "本", "串", "盏", "台", "顶",
+    "卷", "副", "份", "幅", "层", "款", "种", "色", "捆", "箱", "排", "株", "棵",
+    "米", "厘米", "毫米", "公分", "寸", "英寸", "克", "千克", "公斤", "斤", "升", "毫升",
+)
+# 英文单位不区分大小写，且后面不能紧跟字母（避免“3 layers”被识别为“3 l”）
+LATIN_UNITS = ("cm", "mm", "m", "kg", "g", "ml", "l")
+
+# 卖点分隔符（切分为多条）与分句符（结束当前数量对应的物品名）
+POINT_SEPARATORS = ";；。"
+CLAUSE_SEPARATORS = "、，,"
+
+# 物品名末尾的连接词（“6 个毛绒圣诞球和一卷丝带”中的“和”）
+ITEM_CONNECTIVES = "和及与或"
+
+# 单一扫描器：分隔符、数字（可带量词）按出现顺序一次匹配，量词长词优先
+TOKEN_PATTERN = re.compile(
+    "(?P<point>[" + POINT_SEPARATORS + "])"
+    "|(?P<clause>[" + CLAUSE_SEPARATORS + "])"
+    r"|(?P<count>\d+(?:\.\d+)?|[" + CHINESE_NUMERALS + r"]+)"
+    r"(?:\s*(?P<unit>" + "|".join(sorted(CLASSIFIERS, key=len, reverse=True))
+    + r"|(?i:" + "|".join(sorted(LATIN_UNITS, key=len, reverse=True)) + r")(?![A-Za-z])))?"
+)
+
+# 一条卖点：原文、[(片段, 是否高亮)]、[(数量, 单位, 物品)]
+Point = namedtuple("Point", "text segments quantities")
+Quantity = namedtuple("Quantity", "count unit item")
+
+_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+           "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_SMALL_UNITS = {"十": 10, "百": 100, "千": 1000}
+_LARGE_UNITS = {"万": 10000, "亿": 100000000}
+
+def chinese_to_number(text):
+    """中文数字转整数，如“十二”→12、“一百零五”→105、“两万”→20000"""
+    total = section = digit = 0
+    for char in text:
+        if char in _DIGITS:
+            digit = _DIGITS[char]
+        elif char in _SMALL_UNITS:
+            section += (digit or 1) * _SMALL_UNITS[char]
+            digit = 0
+        else:
+            total = (total + section + digit) * _LARGE_UNITS[char]
+            section = digit = 0
+    return total + section + digit
+
+def to_number(count):
+    """数量文本转数值：阿拉伯数字按整数/小数解析，其余按中文数字解析"""
+    if count[0].isdigit():
+        return float(count) if "." in count else int(count)
+    return chinese_to_number(count)
+
+def scan(text, split_points=True):
+    """单次线性扫描文本，返回 [Point]
+
+    split_points 为 True 时按 ;；。切分为多条卖点（空条目丢弃），否则整段作为一条。
+    阿拉伯数字总是高亮；中文数字只有后接量词时才高亮并计为数量。
+    数量对应的物品为量词之后到下一个分句符、分隔符或数量为止的文本。
+    """
+    points = []
+    segments = []
+    quantities = []
+    pending = None  # 尚未结束的数量：(数量, 单位, 物品起始位置)
+    pos = 0
+
+    def close_quantity(end):
+        nonlocal pending
+        if pending is not None:
+            count, unit, item_start = pending
+            quantities.append(Quantity(count, unit, text[item_start:end].strip().rstrip(ITEM_CONNECTIVES).rstrip()))
+            pending = None
+
+    def close_point(end):
+        nonlocal segments, quantities
+        close_quantity(end)
+        if pos < end:
+            segments.append((text[pos:end], False))
+        # 去掉首尾空白；高亮片段不含首尾空白，只需处理两端的普通片段
+        while segments and not segments[0][1] and not segments[0][0].strip():
+            segments.pop(0)
+        while segments and not segments[-1][1] and not segments[-1][0].strip():
+            segments.pop()
+        if segments:
+            if not segments[0][1]:
+                segments[0] = (segments[0][0].lstrip(), False)
+            if not segments[-1][1]:
+                segments[-1] = (segments[-1][0].rstrip(), False)
+            points.append(Point("".join(segment for segment, _ in segments), segments, quantities))
+        segments = []
+        quantities = []
+
+    for match in TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "point":
+            if split_points:
+                close_point(match.start())
+                pos = match.end()
+            else:
+                close_quantity(match.start())
+            continue
+        if kind == "clause":
+            close_quantity(match.start())
+            continue
+
+        count, unit = match.group("count"), match.group("unit")
+        if unit is None and not count[0].isdigit():
+            continue  # 不带量词的中文数字按普通文字处理
+        close_quantity(match.start())
+        if match.start() > pos:
+            segments.append((text[pos:match.start()], False))
+        segments.append((match.group(0), True))
+        pos = match.end()
+        if unit is not None:
+            pending = (to_number(count), unit, pos)
+
+    close_point(len(text))
+    return points
+
+def parse(text):
+    """解析单条文本（不切分），返回 Point；空文本返回空结果"""
+    points = scan(text, split_points=False)
+    return points[0] if points else Point("", [], [])
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import logging
+import threading
+import quantities
+
+# 规则文件路径（可通过环境变量 RULES_PATH 覆盖）
+DEFAULT_RULES_PATH = os.environ.get(
+    "RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+
+# 当前程序支持的规则文件版本
+SUPPORTED_VERSIONS = (1,)
+
+def compile_keywords(keywords):
+    """将关键词列表编译为一个正则（长词优先），用于一次扫描判断是否包含任一关键词"""
+    keywords = sorted(set(keywords), key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+
+class Trie:
+    """字符前缀树，值挂在词尾节点上；匹配只沿文本走一遍，与词表大小无关"""
+
+    _END = object()
+
+    def __init__(self, words=None):
+        self.root = {}
+        for word, value in (words or {}).items():
+            self.add(word, value)
+
+    def add(self, word, value):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[self._END] = value
+
+    def longest_prefix(self, text, start=0):
+        """从 start 开始匹配最长的词，返回 (结束位置, 值)；没有匹配时返回 (None, None)"""
+        node = self.root
+        end = value = None
+        for pos in range(start, len(text)):
+            node = node.get(text[pos])
+            if node is None:
+                break
+            if self._END in node:
+                end, value = pos + 1, node[self._END]
+        return end, value
+
+
+class PropCatalog:
+    """道具目录：把写法不同的道具描述归一为目录中的标准名称
+
+    1. 去掉开头的数量（“两卷”）和修饰词（颜色、尺寸等，可连续多个，如“红色绿色”），修饰词用前缀树匹配；
+    2. 用反向字符树匹配最长的目录名称或别名后缀（中文名词中心语在末尾，“毛绒圣诞球”→“圣诞球”）。
+    未命中目录的道具保留去掉修饰词后的文本；只有修饰词时保留原文。
+    """
+
+    def __init__(self, catalog=(), modifiers=()):
+        self.names = [item["name"] for item in catalog]
+        self.modifiers = Trie({modifier: modifier for modifier in modifiers})
+        # 名称与别名倒序插入，后缀匹配即为反向文本的前缀匹配
+        self.suffixes = Trie()
+        for item in catalog:
+            for word in [item["name"], *item.get("aliases", [])]:
+                self.suffixes.add(word[::-1], item["name"])
+
+    def strip_modifiers(self, prop):
+        """去掉开头的数量和修饰词（及其后的“的”），如“两卷红色蜡笔”→“蜡笔”（不在目录中的道具同样处理）
+
+        数字加量词开头的也可能是名称本身（“三色堇”“千层面”），因此数量只在其后有空白、紧跟修饰词
+        或余下部分能匹配目录名称时才去掉
+        """
+        match = quantities.TOKEN_PATTERN.match(prop)
+        if match and match.group("count") and match.group("unit"):
+            rest = prop[match.end():]
+            core, stripped = self._strip_leading_modifiers(rest.lstrip())
+            if core and (rest[:1].isspace() or stripped or self._catalog_name(core)):
+                return core
+        core, _ = self._strip_leading_modifiers(prop)
+        return core or prop
+
+    def _strip_leading_modifiers(self, text):
+        """去掉开头连续的修饰词，返回 (余下文本, 是否去掉了修饰词)"""
+        pos = 0
+        while pos < len(text):
+            end, _ = self.modifiers.longest_prefix(text, pos)
+            if end is None:
+                break
+            pos = end + 1 if text.startswith("的", end) else end
+        return text[pos:].strip(), pos > 0
+
+    def _catalog_name(self, core):
+        """按最长后缀匹配目录名称，未命中返回 None"""
+        _, name = self.suffixes.longest_prefix(core[::-1])
+        return name
+
+    def canonicalize(self, prop):
+        """返回道具的标准名称"""
+        core = self.strip_modifiers(prop)
+        return self._catalog_name(core) or core
+
+
+class Rules:
+    """页面识别与内容提取规则，从配置文件加载后预编译"""
+
+    def __init__(self, config, path=None, mtime=None):
+        version = config.get("version")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"不支持的规则文件版本: {version}")
+        
+        self.version = version
+        self.path = path
+        self.mtime = mtime
+        self.slide_types = [
+            (item["type"], compile_keywords(item["keywords"])) for item in config["slide_types"]
+        ]
+        self.prop_categories = [
+            (item["category"], compile_keywords(item["keywords"])) for item in config["prop_categories"]
+        ]
+        self.default_prop_category = config["default_prop_category"]
+        
+        # 道具类别名（有序），用于初始化数据结构和输出
+        self.prop_category_names = [category for category, _ in self.prop_categories]
+        if self.default_prop_category not in self.prop_category_names:
+            self.prop_category_names.append(self.default_prop_category)
+        
+        self.prop_split_words = list(config.get("prop_split_words", []))
+        self.prop_catalog = PropCatalog(config.get("prop_catalog", []), config.get("prop_modifiers", []))
+        self.scene_stop_words = list(config.get("scene_stop_words", []))
+        self.scene_angle_pattern = compile_keywords(config.get("scene_angle_keywords", []))
+        self.scene_location_pattern = compile_keywords(config.get("scene_location_words", []))
+
+    @classmethod
+    def load(cls, path):
+        """从JSON文件加载规则"""
+        mtime = os.path.getmtime(path)
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(config, path=path, mtime=mtime)
+
+    def match_slide_type(self, text):
+        """返回第一个命中的页面类型，未命中返回 None"""
+        for slide_type, pattern in self.slide_types:
+            if pattern and pattern.search(text):
+                return slide_type
+        return None
+
+    def match_prop_category(self, prop):
+        """返回道具类别，未命中任何关键词时返回默认类别"""
+        for category, pattern in self.prop_categories:
+            if pattern and pattern.search(prop):
+                return category
+        return self.default_prop_category
+
+    def truncate_prop(self, prop):
+        """按分隔词（等/及/或）截断道具描述，按配置顺序取第一个出现的分隔词"""
+        for split_word in self.prop_split_words:
+            if split_word in prop:
+                return prop.split(split_word)[0].strip()
+        return prop
+
+    def canonicalize_prop(self, prop):
+        """将道具描述归一为道具目录中的标准名称"""
+        return self.prop_catalog.canonicalize(prop)
+
+
+_current_rules = None
+_lock = threading.Lock()
+
+def get_rules():
+    """获取当前规则（首次调用时加载）"""
+    global _current_rules
+    if _current_rules is None:
+        with _lock:
+            if _current_rules is None:
+                _current_rules = Rules.load(DEFAULT_RULES_PATH)
+                logging.info(f"加载规则文件: {DEFAULT_RULES_PATH} (版本 {_current_rules.version})")
+    return _current_rules
+
+def reload_if_changed():
+    """规则文件修改后重新加载；新文件有误时保留旧规则。返回当前规则"""
+    global _current_rules
+    rules = get_rules()
+    try:
+        mtime = os.path.getmtime(rules.path)
+    except OSError as e:
+        logging.error(f"读取规则文件失败: {e}")
+        return rules
+    
+    if mtime != rules.mtime:
+        with _lock:
+            if _current_rules is rules:
+                try:
+                    _current_rules = Rules.load(rules.path)
+                    logging.info(f"重新加载规则文件: {rules.path} (版本 {_current_rules.version})")
+                except Exception as e:
+                    # 任何错误（包括结构不对导致的 TypeError/AttributeError）都保留旧规则；
+                    # 记录新的 mtime，避免对同一个错误文件反复重试
+                    rules.mtime = mtime
+                    logging.error(f"规则文件有误，继续使用旧规则: {e}")
+    return _current_rules
@@ -3,11 +3,25 @@
 
 import os
 import re
+import gc
 import sys
+import html
+import json
 import glob
+import time
+import shutil
+import hashlib
 import logging
+import zipfile
+import argparse
+import functools
+import tempfile
+import threading
 from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pptx import Presentation
+from pptx.shapes.picture import Picture
 from PIL import Image as PILImage
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -16,40 +30,450 @@ from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
+from rules import get_rules
+import quantities
+import tracing
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 页面布局（PDF 与 DOCX 共用，单位为 point）
+PAGE_MARGIN = 30
+MAIN_IMAGE_WIDTH = 4 * inch  # 产品主图宽度为4英寸
+REFERENCE_COLUMN_WIDTH = (A4[0] - 2 * PAGE_MARGIN) / 3  # 参考风格三列布局
+HEADING_COLOR = '#0066CC'  # 标题蓝色
+NUMBER_COLOR = 'red'  # 数量信息红色加粗
+
+# 内存保护：预估峰值内存超过阈值时自动切换到低内存模式（单位 MB）
+LOW_MEMORY_THRESHOLD_MB = int(os.environ.get("LOW_MEMORY_THRESHOLD_MB", 1024))
+# 压缩图片解码后的大致膨胀倍数（JPEG/PNG 解码为 RGB 位图）
+IMAGE_DECODE_FACTOR = 10
+# 渲染器（reportlab / python-docx）可直接使用的图片格式，其他格式需要先转换；
+# 手机拍摄的 JPEG 常被 Pillow 识别为 MPO（首帧即标准 JPEG），同样直接使用
+PASSTHROUGH_FORMATS = ("JPEG", "MPO", "PNG", "GIF")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".wdp", ".emf", ".wmf")
+
+# PDF 输出档位（可通过环境变量 PDF_PROFILE 指定默认档位）
+#   dpi: 图片按版面尺寸计算的最高分辨率，超过时缩小并重新编码
+#   jpeg_quality: 重新编码时的 JPEG 质量
+# 所有档位都压缩页面内容流，内容相同的图片只嵌入一次（按内容哈希共享同一个图片 XObject）
+PDF_PROFILES = {
+    "draft": {"dpi": 72, "jpeg_quality": 50},
+    "screen": {"dpi": 150, "jpeg_quality": 75},
+    "print": {"dpi": 300, "jpeg_quality": 90},
+}
+DEFAULT_PDF_PROFILE = os.environ.get("PDF_PROFILE", "print")
+
+# 图片导出：并行线程数与流式读写块大小
+ASSET_EXPORT_WORKERS = int(os.environ.get("ASSET_EXPORT_WORKERS", min(8, os.cpu_count() or 1)))
+ASSET_CHUNK_SIZE = 1024 * 1024
+
+# PDF 章节缓存目录：设置后五个章节分别排版并按输入数据缓存，修改稿只重新排版有变化的章节（需要 pypdf）；
+# 每个章节各嵌入一份字体子集，拼接后无法合并，输出文件比整篇排版大
+PDF_SECTION_CACHE_DIR = os.environ.get("PDF_SECTION_CACHE_DIR")
+# 章节排版代码或样式修改后递增，使旧缓存失效
+PDF_SECTION_CACHE_VERSION = 1
+# 超过该天数未被使用的章节缓存在排版时删除（命中时刷新修改时间）
+PDF_SECTION_CACHE_MAX_AGE_DAYS = float(os.environ.get("PDF_SECTION_CACHE_MAX_AGE_DAYS", 30))
+
+def prune_section_cache():
+    """删除超过 PDF_SECTION_CACHE_MAX_AGE_DAYS 天未使用的章节缓存和遗留的临时文件"""
+    cutoff = time.time() - PDF_SECTION_CACHE_MAX_AGE_DAYS * 86400
+    for entry in os.scandir(PDF_SECTION_CACHE_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+def estimate_peak_memory(filename):
+    """只读取zip目录，按图片部件大小预估转换时的峰值内存（MB）"""
+    with zipfile.ZipFile(filename) as zf:
+        infos = zf.infolist()
+    total = sum(info.file_size for info in infos)
+    images = sum(info.file_size for info in infos
+                 if info.filename.startswith("ppt/media/") and info.filename.lower().endswith(IMAGE_EXTENSIONS))
+    # python-pptx 会把全部部件读入内存，图片在排版时还会被解码
+    return (total + images * IMAGE_DECODE_FACTOR) / (1024 * 1024)
+
+def reset_peak_rss():
+    """重置进程的峰值内存记录（仅 Linux 支持，其他平台忽略）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """返回进程峰值内存（MB）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# 峰值内存是整个进程的统计：只有重置成功且期间没有其他转换时，才能算作本次转换的峰值
+_rss_lock = threading.Lock()
+_rss_active = 0
+_rss_epoch = 0
+
+def begin_peak_rss():
+    """开始一次转换的峰值内存统计，返回交给 measure_peak_rss 的标记"""
+    global _rss_active, _rss_epoch
+    with _rss_lock:
+        _rss_active += 1
+        _rss_epoch += 1
+        # 有其他转换在进行时不重置，以免清掉它们的峰值
+        exact = _rss_active == 1 and reset_peak_rss()
+        return _rss_epoch, exact
+
+def measure_peak_rss(token):
+    """返回 (峰值MB, 是否只属于本次转换)；期间有其他转换开始时只是进程整体的近似值"""
+    epoch, exact = token
+    with _rss_lock:
+        return peak_rss_mb(), exact and epoch == _rss_epoch
+
+def end_peak_rss():
+    """结束一次转换的峰值内存统计"""
+    global _rss_active
+    with _rss_lock:
+        _rss_active -= 1
+
+# 性能分析摘要中列出的热点函数数量
+PROFILE_TOP_N = 30
+
+def profile_call(output_base, func, *args, **kwargs):
+    """在 cProfile 下运行 func，生成 <output_base>_profile.prof 与热点摘要 <output_base>_profile.txt"""
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        prof_path = output_base + "_profile.prof"
+        summary_path = output_base + "_profile.txt"
+        profiler.dump_stats(prof_path)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            stats = pstats.Stats(profiler, stream=f).strip_dirs()
+            f.write(f"=== 累计耗时前 {PROFILE_TOP_N} 的函数 ===\n")
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            f.write(f"=== 自身耗时前 {PROFILE_TOP_N} 的函数 ===\n")
+            stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+            f.write("=== 转换各阶段（process_file / 页面处理 / 文档生成） ===\n")
+            stats.sort_stats("cumulative").print_stats(
+                r"script_generator.py:\d+\((process_file|extract|render|process_\w+|generate_\w+|prepare_image)\)")
+        logging.info(f"性能分析结果: {prof_path}，摘要: {summary_path}")
+
+# 默认字体路径（可通过环境变量 FONT_PATH 覆盖）
+DEFAULT_FONT_PATH = "/System/Library/Fonts/STHeiti Light.ttc"
+
+def register_font(font_path=None, font_name="STHeiti"):
+    """注册中文字体，已注册时直接返回"""
+    if font_name in pdfmetrics.getRegisteredFontNames():
+        return
+    font_path = font_path or os.environ.get("FONT_PATH", DEFAULT_FONT_PATH)
+    pdfmetrics.registerFont(TTFont(font_name, font_path))
+    logging.info(f"成功加载字体: {font_name} ({font_path})")
+
+# 解析时不读取的媒体部件（图片、视频、音频），以空内容代替
+MEDIA_PREFIX = "ppt/media/"
+
+def open_presentation(filename):
+    """打开PPTX但跳过 ppt/media/ 下的媒体数据：复制一份媒体部件为空的zip交给 python-pptx，
+    避免其在加载时读入全部图片和视频；图片在需要时通过 ImageRef 按需读取"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(filename) as src, zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as dst:
+        for info in src.infolist():
+            if info.filename.startswith(MEDIA_PREFIX):
+                dst.writestr(info.filename, b"")
+            else:
+                dst.writestr(info.filename, src.read(info))
+    buffer.seek(0)
+    return Presentation(buffer)
+
+# 预检：幻灯片XML部件与其中的文字（<a:t> 为文字，</a:p> 为段落结束）
+SLIDE_PART_PATTERN = re.compile(r"ppt/slides/slide\d+\.xml")
+SLIDE_TEXT_PATTERN = re.compile(r"<a:t(?:\s[^>]*)?>([^<]*)</a:t>|</a:p>")
+
+def preflight(filename, rules=None):
+    """快速判断文件是否为拍摄需求模板：只读zip目录和幻灯片XML中的文字，不构建 Presentation、不读取媒体
+
+    返回 {"confidence": 识别到的模板页面类型占比（0~1）, "found": [...], "missing": [...],
+          "slides": 幻灯片数, "elapsed_ms": 耗时}；全部页面类型都找到后不再读取剩余幻灯片
+    """
+    started = time.perf_counter()
+    rules = rules or get_rules()
+    types = [slide_type for slide_type, _ in rules.slide_types]
+    found = set()
+    with zipfile.ZipFile(filename) as zf:
+        slides = [name for name in zf.namelist() if SLIDE_PART_PATTERN.fullmatch(name)]
+        for name in slides:
+            xml = zf.read(name).decode("utf-8", "replace")
+            text = "".join(
+                html.unescape(match.group(1)) if match.group(1) is not None else "\n"
+                for match in SLIDE_TEXT_PATTERN.finditer(xml)
+            )
+            slide_type = rules.match_slide_type(text)
+            if slide_type:
+                found.add(slide_type)
+                if len(found) == len(types):
+                    break
+    return {
+        "confidence": round(len(found) / len(types), 2) if types else 0.0,
+        "found": [slide_type for slide_type in types if slide_type in found],
+        "missing": [slide_type for slide_type in types if slide_type not in found],
+        "slides": len(slides),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+class ImageRef:
+    """PPTX 中图片部件的引用，只在渲染需要时才从zip中读取"""
+
+    __slots__ = ("path", "member")
+
+    def __init__(self, path, member):
+        self.path = path
+        self.member = member
+
+    def __eq__(self, other):
+        return isinstance(other, ImageRef) and (self.path, self.member) == (other.path, other.member)
+
+    def __hash__(self):
+        return hash((self.path, self.member))
+
+    def __repr__(self):
+        return f"ImageRef({self.member!r})"
+
+    @property
+    def ext(self):
+        """图片扩展名（小写，不含点）"""
+        return os.path.splitext(self.member)[1].lstrip(".").lower()
+
+    def read(self):
+        """读取图片字节"""
+        with zipfile.ZipFile(self.path) as zf:
+            return zf.read(self.member)
+
+    def extract_to(self, path):
+        """将图片流式写入文件，不在内存中保留完整数据"""
+        with zipfile.ZipFile(self.path) as zf, zf.open(self.member) as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        return path
+
+
+def export_image(image, images_dir):
+    """把一张图片以原始格式写入 images_dir，文件名为内容哈希；同名文件已存在时只计算哈希不写入
+
+    返回 (文件路径, sha1, 是否写入)；先写临时文件再改名，并发写入同一图片也不会留下半个文件
+    """
+    with zipfile.ZipFile(image.path) as zf:
+        digest = hashlib.sha1()
+        with zf.open(image.member) as src:
+            for chunk in iter(lambda: src.read(ASSET_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        path = os.path.join(images_dir, f"{digest[:16]}.{image.ext}")
+        if os.path.exists(path):
+            return path, digest, False
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with zf.open(image.member) as src, open(temp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, ASSET_CHUNK_SIZE)
+            os.replace(temp_path, path)
+        finally:
+            # 写入或改名失败时不留下临时文件
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return path, digest, True
+
+
+@functools.lru_cache(maxsize=None)
+def get_pdf_styles(font_name):
+    """创建PDF段落样式（只读，按字体缓存，进程内及 fork 出的子进程间共享）"""
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontName=font_name,
+        fontSize=28,
+        textColor=colors.black,  # 主标题使用黑色
+        spaceAfter=30,
+        alignment=1  # 居中
+    )
+    
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontName=font_name,
+        fontSize=20,
+        textColor=colors.HexColor(HEADING_COLOR),  # 其他标题使用蓝色
+        spaceAfter=20
+    )
+    
+    # 添加子标题样式
+    subheading_style = ParagraphStyle(
+        'CustomSubHeading',
+        parent=styles['Heading3'],
+        fontName=font_name,
+        fontSize=16,
+        textColor=colors.black,
+        spaceAfter=10,
+        spaceBefore=10
+    )
+    
+    normal_style = ParagraphStyle(
+        'CustomNormal',
+        parent=styles['Normal'],
+        fontName=font_name,
+        fontSize=12,
+        leading=20,
+        spaceAfter=10
+    )
+    
+    bullet_style = ParagraphStyle(
+        'CustomBullet',
+        parent=styles['Normal'],
+        fontName=font_name,
+        fontSize=12,
+        leading=20,
+        leftIndent=20,
+        spaceAfter=5
+    )
+    
+    return {
+        "title": title_style,
+        "heading": heading_style,
+        "subheading": subheading_style,
+        "normal": normal_style,
+        "bullet": bullet_style,
+    }
+
+def warm_up(font_name="STHeiti"):
+    """预先完成首次转换才会做的初始化：字体、样式、规则、图片插件和排版代码路径。
+    在 gunicorn 主进程 fork 前调用，worker 通过写时复制共享这些只读状态"""
+    register_font(font_name=font_name)
+    get_rules()
+    styles = get_pdf_styles(font_name)
+    PILImage.init()
+    try:
+        import docx  # noqa: F401  （可选依赖，仅用于预加载）
+    except ImportError:
+        pass
+    
+    # 渲染一份极小的PDF，预热 reportlab 的字体度量与排版代码
+    doc = SimpleDocTemplate(BytesIO(), pagesize=A4)
+    doc.build([Paragraph("拍摄需求文档 <b><font color='red'>12</font></b> 个", styles["normal"])])
+    logging.info("预热完成")
+
+class LRUCache:
+    """线程安全的有界 LRU 缓存，记录命中次数"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """返回缓存值，未命中返回 None"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# 文本分析缓存：同一模板生成的文件中，相同的“布景：…道具：…”文本反复出现
+TEXT_ANALYSIS_CACHE = LRUCache(int(os.environ.get("TEXT_CACHE_SIZE", 4096)))
+
+def extracted_diff(before, after):
+    """比较两次 to_dict() 的结果，只返回新增或变化的部分（列表只保留新增项），无变化返回 None"""
+    if isinstance(after, dict):
+        diff = {}
+        for key, value in after.items():
+            changed = extracted_diff(before.get(key), value)
+            if changed is not None:
+                diff[key] = changed
+        return diff or None
+    if isinstance(after, list):
+        added = [item for item in after if item not in (before or [])]
+        return added or None
+    return None if after == before else after
+
+
+class ConversionCancelled(Exception):
+    """转换被取消（由进度回调抛出）"""
+
+
 class ScriptGenerator:
-    def __init__(self):
-        """初始化脚本生成器"""
+    def __init__(self, rules=None):
+        """初始化脚本生成器
+
+        rules: 页面识别与提取规则（rules.Rules），默认使用 rules.json 中的当前规则
+        """
         self.font_name = "STHeiti"
+        self.rules = rules or get_rules()
         logging.info("初始化 ScriptGenerator 完成")
-        self.script_data = {
+        self.script_data = self.new_script_data()
+        self.current_page = 0
+        self.total_pages = 0
+        self.current_file = ""
+        self.progress_callback = None
+        self._prepared_images = {}
+        self.low_memory = False
+        self._spool_dir = None
+        self._spooled_images = {}
+        self.spool_root = None  # 临时图片目录的上级目录，默认为系统临时目录
+        self.assets = {}  # 已导出的图片：{ImageRef: 文件路径}
+        self.tracer = tracing.NULL_TRACER
+        self.pdf_profile = DEFAULT_PDF_PROFILE
+        self.stats = {}
+
+    def new_script_data(self):
+        """创建空的提取结果结构，道具类别取自规则配置"""
+        return {
             "产品信息": {
                 "名称": "",
                 "链接": "",
                 "主图": None
             },
             "产品卖点": [],
+            "卖点数量": [],  # 卖点中的数量：[(数量, 单位, 物品)]
             "参考风格": [],
             "布景": {
                 "布景风格": set(),  # 存储从"布景："后面提取的风格
-                "拍摄场景": set(),  # 存储表格第一行的场景
-                "拍摄场景": set()   # 将"场景内容"改为"拍摄场景"
+                "拍摄场景": set()   # 存储表格第一行的场景
             },
-            "道具": {
-                "装饰挂件": set(),
-                "装饰材料": set(),
-                "绿植类": set(),
-                "辅助工具": set(),
-                "套装类": set(),
-                "场景布置": set()
-            }
+            "道具": {category: set() for category in self.rules.prop_category_names}
         }
-        self.current_page = 0
-        self.total_pages = 0
-        self.current_file = ""
+
+    def report_progress(self, stage):
+        """通知进度回调，参数为 (阶段, 当前页, 总页数)；回调可抛出 ConversionCancelled 以中止转换"""
+        if self.progress_callback is not None:
+            self.progress_callback(stage, self.current_page, self.total_pages)
 
     def identify_slide_type(self, slide):
         """识别幻灯片类型"""
@@ -59,18 +483,10 @@ class ScriptGenerator:
                 texts.append(shape.text.strip())
         text = "\n".join(texts)
         
-        if "产品信息" in text or any(keyword in text for keyword in ["产品链接", "产品名称"]):
-            logging.info("识别为产品信息")
-            return "产品信息页面"
-        elif "产品卖点" in text:
-            logging.info("识别为产品卖点页面")
-            return "产品卖点页面"
-        elif "参考风格" in text:
-            logging.info("识别为参考风格页")
-            return "参考风格页面"
-        elif "拍摄思路" in text:
-            logging.info("识别为拍摄思路页面")
-            return "拍摄思路页面"
+        slide_type = self.rules.match_slide_type(text)
+        if slide_type:
+            logging.info(f"识别为{slide_type}")
+            return slide_type
         
         logging.info("未识别页面类型")
         return None
@@ -96,10 +512,12 @@ class ScriptGenerator:
                     logging.info(f"提取产品链接: {link}")
             
             # 提取产品图片
-            if hasattr(shape, "image") and self.script_data["产品信息"]["主图"] is None:
+            if self.script_data["产品信息"]["主图"] is None:
                 try:
-                    self.script_data["产品信息"]["主图"] = shape.image.blob
-                    logging.info("成功提取产品图片")
+                    image = self.image_ref(shape)
+                    if image is not None:
+                        self.script_data["产品信息"]["主图"] = image
+                        logging.info("成功提取产品图片")
                 except Exception as e:
                     logging.error(f"提取产品图片失败: {e}")
 
@@ -114,28 +532,83 @@ class ScriptGenerator:
                     texts.append(text)
                     logging.info(f"提取产品卖点: {text}")
         
-        # 分割文本并添加到卖点列表
+        # 一次扫描完成切分与数量识别，添加到卖点列表
         for text in texts:
-            points = re.split(r'[;；。]', text)
-            for point in points:
-                point = point.strip()
-                if point and point not in self.script_data["产品卖点"]:
-                    self.script_data["产品卖点"].append(point)
+            for point in quantities.scan(text):
+                if point.text not in self.script_data["产品卖点"]:
+                    self.script_data["产品卖点"].append(point.text)
+                    self.script_data["卖点数量"].extend(point.quantities)
 
     def process_reference_style(self, slide):
         """处理参考风格页面"""
         logging.info("开始理参考风格页")
         for shape in slide.shapes:
-            if hasattr(shape, "image"):
-                try:
-                    self.script_data["参考风格"].append(shape.image.blob)
+            try:
+                image = self.image_ref(shape)
+                if image is not None:
+                    self.script_data["参考风格"].append(image)
                     logging.info("成功提取参考风格图片")
-                except Exception as e:
-                    logging.error(f"提取参考风格图片失败: {e}")
+            except Exception as e:
+                logging.error(f"提取参考风格图片失败: {e}")
 
-    def extract_scene_and_props(self, text, table_cells=None):
-        """从文本中提取布景和道具信息"""
-        logging.info(f"\n开始分析文本: {text}")
+    def image_ref(self, shape):
+        """返回图片形状的 ImageRef，非图片形状返回 None；只记录部件位置，不读取图片数据
+
+        只接受图片和已填充的图片占位符（Picture）；视频等形状虽然也有 blip（封面帧），但不是图片
+        """
+        if not isinstance(shape, Picture):
+            return None
+        rId = getattr(shape._element, "blip_rId", None)
+        if rId is None:
+            return None
+        part = shape.part.related_part(rId)
+        return ImageRef(self.current_file, part.partname.lstrip("/"))
+
+    def open_image(self, image):
+        """返回图片的可读对象：ImageRef 逐张流式写入临时目录并返回文件路径（不在内存中保留图片数据，
+        JPEG 文件可被 reportlab 原样嵌入PDF）；已是路径或字节时直接使用"""
+        if isinstance(image, ImageRef):
+            if image in self.assets:
+                return self.assets[image]
+            if image not in self._spooled_images:
+                path = os.path.join(self.spool_dir(), f"image_{len(self._spooled_images)}.{image.ext}")
+                self._spooled_images[image] = image.extract_to(path)
+            return self._spooled_images[image]
+        return image if isinstance(image, str) else BytesIO(image)
+
+    def export_assets(self, images_dir, workers=None):
+        """把主图和参考风格图片按内容哈希命名、以原始格式并行写入 images_dir，每张不同的图片只写一次
+
+        已存在的文件跳过写入（重复运行只读取计算哈希）；之后各输出格式直接使用导出的文件。
+        返回 {ImageRef: 文件路径}
+        """
+        main_image = self.script_data["产品信息"]["主图"]
+        images = list(dict.fromkeys(
+            image for image in [main_image, *self.script_data["参考风格"]] if isinstance(image, ImageRef)))
+        os.makedirs(images_dir, exist_ok=True)
+        with self.tracer.span("export_assets", images=len(images)):
+            with ThreadPoolExecutor(max_workers=workers or ASSET_EXPORT_WORKERS) as executor:
+                results = list(executor.map(lambda image: export_image(image, images_dir), images))
+        written = 0
+        for image, (path, digest, wrote) in zip(images, results):
+            self.assets[image] = path
+            # PDF 去重直接使用已算出的哈希
+            self._spooled_images[("sha1", path)] = digest
+            written += wrote
+        self.stats["assets"] = {"dir": images_dir, "written": written, "skipped": len(images) - written}
+        return self.assets
+
+    def spool_dir(self):
+        """本次转换的临时图片目录，转换结束后删除；设置 spool_root 后建在其下，
+        进程意外退出时可由 spool_root 的所有者一并清理"""
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix="script_images_", dir=self.spool_root)
+        return self._spool_dir
+
+    def analyze_text(self, text):
+        """分析一段文本，返回 (布景风格元组, ((类别, 道具), ...))；结果只取决于文本和规则，可缓存"""
+        styles = []
+        props = []
         
         # 提取布景风格
         if "布景：" in text:
@@ -144,38 +617,59 @@ class ScriptGenerator:
                 style_text = style_text.split("道具：")[0]
             style = style_text.strip()
             if style:
-                self.script_data["布景"]["布景风格"].add(style)
-                logging.info(f"提取布景风格: {style}")
-        
-        # 提取场景（如果提供了表格单元格）
-        if table_cells and len(table_cells) > 0:
-            # 检查第一个单元格否为"场景"（表头），如果是则跳过
-            scene = table_cells[0].strip()
-            if scene and scene != "场景":
-                self.script_data["布景"]["拍摄场景"].add(scene)
-                logging.info(f"提取拍摄场景: {scene}")
+                styles.append(style)
         
         # 提取道具信息
         if "道具：" in text:
             props_text = text.split("道具：")[1].strip()
             # 处理多种分隔符
-            props = []
+            candidates = []
             for prop in re.split(r'[,，、\n]', props_text):
                 # 处理空格分隔的道具
-                props.extend([p.strip() for p in re.split(r'\s+', prop) if p.strip()])
+                candidates.extend([p.strip() for p in re.split(r'\s+', prop) if p.strip()])
             
-            for prop in props:
+            for prop in candidates:
+                # 处理带括号的说明文本
+                if '（' in prop:
+                    prop = prop.split('（')[0].strip()
+                # 处理包含"等"、"及"、"或"的情况
+                prop = self.rules.truncate_prop(prop)
                 if prop:
-                    # 处理带括号的说明文本
-                    if '（' in prop:
-                        prop = prop.split('（')[0].strip()
-                    # 处理包含"等"、"及"、"或"的情况
-                    for split_word in ["等", "及", "或"]:
-                        if split_word in prop:
-                            prop = prop.split(split_word)[0].strip()
-                            break
-                    if prop:
-                        self.classify_prop(prop)
+                    # 归一为目录中的标准名称，合并“红色桌纸”“桌纸”等写法
+                    prop = self.rules.canonicalize_prop(prop)
+                    props.append((self.rules.match_prop_category(prop), prop))
+        
+        return tuple(styles), tuple(props)
+
+    def extract_scene_and_props(self, text, table_cells=None):
+        """从文本中提取布景和道具信息（完全相同的文本的分析结果从缓存读取）"""
+        key = (self.rules, text)
+        result = TEXT_ANALYSIS_CACHE.get(key)
+        if result is None:
+            logging.info(f"\n开始分析文本: {text}")
+            result = self.analyze_text(text)
+            TEXT_ANALYSIS_CACHE.put(key, result)
+            self.stats["text_cache_misses"] = self.stats.get("text_cache_misses", 0) + 1
+        else:
+            logging.info(f"\n使用缓存的分析结果: {text}")
+            self.stats["text_cache_hits"] = self.stats.get("text_cache_hits", 0) + 1
+        styles, props = result
+        
+        for style in styles:
+            self.script_data["布景"]["布景风格"].add(style)
+            logging.info(f"提取布景风格: {style}")
+        
+        # 提取场景（如果提供了表格单元格）
+        if table_cells and len(table_cells) > 0:
+            # 检查第一个单元格否为"场景"（表头），如果是则跳过
+            scene = table_cells[0].strip()
+            if scene and scene != "场景":
+                self.script_data["布景"]["拍摄场景"].add(scene)
+                logging.info(f"提取拍摄场景: {scene}")
+        
+        for category, prop in props:
+            self.script_data["道具"][category].add(prop)
+            logging.info(f"提取{category}道具: {prop}")
 
     def _classify_scene(self, scene, scene_keywords):
         """对场景进行分类"""
@@ -186,13 +680,13 @@ class ScriptGenerator:
         for category, keywords in scene_keywords.items():
             if any(keyword in scene for keyword in keywords):
                 # 对于拍摄角度，需要确保是真正的拍摄相关描述
-                if category == "拍摄角度" and not any(k in scene for k in ["拍摄", "视角", "镜头", "特写", "远景", "近景"]):
+                if category == "拍摄角度" and not (self.rules.scene_angle_pattern and self.rules.scene_angle_pattern.search(scene)):
                     continue
                     
                 # 清理和规范化场景描述
                 cleaned_scene = scene
                 # 移除不必要的词语
-                for word in ["在", "的", "地", "拍摄场景：场景"]:
+                for word in self.rules.scene_stop_words:
                     cleaned_scene = cleaned_scene.replace(word, "")
                 
                 # 检查是否已经存在相同或相似的场景描述
@@ -203,7 +697,7 @@ class ScriptGenerator:
                 return  # 一个场景只分到一个类别
         
         # 如果没有匹配到任何类别，但包含场景相关词汇，归类到实景场景
-        if any(word in scene for word in ["前", "后", "处", "边", "旁", "位"]):
+        if self.rules.scene_location_pattern and self.rules.scene_location_pattern.search(scene):
             # 检查是否已经存在相同或相似的场景描述
             if not any(existing_scene in scene or scene in existing_scene 
                       for existing_scene in self.script_data["布景"]["实景场景"]):
@@ -211,27 +705,10 @@ class ScriptGenerator:
                 logging.info(f"提取实景场景: {scene}")
 
     def classify_prop(self, prop):
-        """对道具进行分类"""
-        # 道具类别关键词映射
-        prop_categories = {
-            "装饰挂件": ["挂", "吊", "装饰", "饰品", "球", "花环"],
-            "装饰材料": ["纸", "布", "条", "带", "绳", "丝带", "藤条"],
-            "绿植类": ["树", "枝", "叶", "花", "草", "绿植"],
-            "辅助工具": ["剪刀", "胶", "钉", "针", "工具"],
-            "套装类": ["套装", "套件", "组合"],
-            "场景布置": ["桌布", "背景", "道具", "布景"]
-        }
-        
-        # 检查每个类别
-        for category, keywords in prop_categories.items():
-            if any(keyword in prop for keyword in keywords):
-                self.script_data["道具"][category].add(prop)
-                logging.info(f"提取{category}道具: {prop}")
-                return  # 个道具只分到一个类别
-        
-        # 如果没有匹配到何类别，归类到场景布置
-        self.script_data["道具"]["场景布置"].add(prop)
-        logging.info(f"提取场景布置道具: {prop}")
+        """对道具进行分类（类别关键词见规则配置，一个道具只分到一个类别，未匹配时归入默认类别）"""
+        category = self.rules.match_prop_category(prop)
+        self.script_data["道具"][category].add(prop)
+        logging.info(f"提取{category}道具: {prop}")
 
     def process_shooting_idea(self, slide):
         """处理拍摄思路页面"""
@@ -263,267 +740,532 @@ class ScriptGenerator:
                 self.script_data["布景"]["拍摄场景"].add(scene)
                 logging.info(f"提取拍摄场景: {scene}")
 
-    def process_file(self, filename):
-        """处理单个PPTX文件"""
-        try:
-            prs = Presentation(filename)
-            self.total_pages = len(prs.slides)
-            print(f"\n总页数: {self.total_pages}\n")
+    def extract(self, filename):
+        """解析PPTX文件，将提取结果写入 self.script_data（只解析一次，供各输出格式共用）"""
+        self.report_progress("parse")
+        self.current_file = filename
+        with self.tracer.span("zip_open"):
+            prs = open_presentation(filename)
+        self.total_pages = len(prs.slides)
+        print(f"\n总页数: {self.total_pages}\n")
+        
+        # 初始化数据结构
+        self.script_data = self.new_script_data()
+        self._prepared_images = {}
+
+        # 处理每一页
+        for i, slide in enumerate(prs.slides, 1):
+            with self.tracer.span("slide", page=i) as span:
+                self.process_slide(i, slide, span)
+        
+        if self.low_memory:
+            # 尽早释放 Presentation（python-pptx 对象间有循环引用，需要主动回收）
+            prs = slide = None
+            gc.collect()
+
+    def process_slide(self, page, slide, span):
+        """识别并处理一页幻灯片，追踪区间按页面类型命名"""
+        self.current_page = page
+        self.report_progress("slide")
+        print(f"{'-'*30}")
+        print(f"处理第 {page} 页:")
+        
+        # 识别页面类型并处理
+        slide_type = self.identify_slide_type(slide)
+        span.rename(f"slide:{slide_type or '未识别'}")
+        if slide_type:
+            print(f"识别为: {slide_type}")
             
-            # 初始化数据结构
-            self.script_data = {
-                "产品信息": {
-                    "名称": "",
-                    "链接": "",
-                    "主图": None
-                },
-                "产品卖点": [],
-                "参考风格": [],
-                "布景": {
-                    "布景风格": set(),
-                    "拍摄场景": set()
-                },
-                "道具": {
-                    "装饰挂件": set(),
-                    "装饰材料": set(),
-                    "绿植类": set(),
-                    "辅助工具": set(),
-                    "套装类": set(),
-                    "场景布置": set()
-                }
+            with self.tracer.span(f"handler:{slide_type}"):
+                self.handle_slide(slide_type, slide)
+        else:
+            print("未识别页面类型")
+
+    def handle_slide(self, slide_type, slide):
+        """按页面类型调用对应的处理函数"""
+        if slide_type == "产品信息页面":
+            self.process_product_info(slide)
+        elif slide_type == "产品卖点页面":
+            self.process_selling_points(slide)
+        elif slide_type == "参考风格页面":
+            self.process_reference_style(slide)
+        elif slide_type == "拍摄思路页面":
+            self.process_shooting_idea(slide)
+
+    def inspect(self, filename):
+        """只解析不输出：返回每页识别出的类型、形状/图片数及该页提取出的内容，以及整份文件的提取结果
+
+        不读取、不解码任何图片，不生成任何文件，用于排查模板变化
+        """
+        started = time.perf_counter()
+        self.current_file = filename
+        self.stats = {}
+        self.script_data = self.new_script_data()
+        prs = open_presentation(filename)
+        self.total_pages = len(prs.slides)
+        slides = []
+        for i, slide in enumerate(prs.slides, 1):
+            self.current_page = i
+            shapes = list(slide.shapes)
+            slide_type = self.identify_slide_type(slide)
+            before = self.to_dict()
+            if slide_type:
+                self.handle_slide(slide_type, slide)
+            slides.append({
+                "page": i,
+                "type": slide_type,
+                "shapes": len(shapes),
+                "text_shapes": sum(hasattr(shape, "text") and bool(shape.text.strip()) for shape in shapes),
+                "images": sum(self.image_ref(shape) is not None for shape in shapes),
+                "tables": sum(getattr(shape, "has_table", False) for shape in shapes),
+                "extracted": extracted_diff(before, self.to_dict()),
+            })
+        found = {item["type"] for item in slides if item["type"]}
+        return {
+            "path": filename,
+            "slides": slides,
+            "missing_types": [slide_type for slide_type, _ in self.rules.slide_types if slide_type not in found],
+            "extracted": self.to_dict(),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def render(self, base_filename, formats=("pdf",)):
+        """按指定格式输出已提取的内容，返回 {格式: 输出文件路径}"""
+        outputs = {}
+        for fmt in formats:
+            if fmt not in RENDERERS:
+                raise ValueError(f"不支持的输出格式: {fmt}")
+            suffix, render_func = RENDERERS[fmt]
+            output_filename = base_filename + suffix
+            self.report_progress(fmt)
+            started = time.perf_counter()
+            with self.tracer.span(f"render:{fmt}"):
+                render_func(self, output_filename)
+            outputs[fmt] = output_filename
+            self.stats.setdefault("outputs", {})[fmt] = {
+                "size_kb": round(os.path.getsize(output_filename) / 1024, 1),
+                "seconds": round(time.perf_counter() - started, 2),
             }
+        return outputs
 
-            # 处理每一页
-            for i, slide in enumerate(prs.slides, 1):
-                self.current_page = i
-                print(f"{'-'*30}")
-                print(f"处理第 {i} 页:")
-                
-                # 识别页面类型并处理
-                slide_type = self.identify_slide_type(slide)
-                if slide_type:
-                    print(f"识别为: {slide_type}")
-                    
-                    if slide_type == "产品信息页面":
-                        self.process_product_info(slide)
-                    elif slide_type == "产品卖点页面":
-                        self.process_selling_points(slide)
-                    elif slide_type == "参考风格页面":
-                        self.process_reference_style(slide)
-                    elif slide_type == "拍摄思路页面":
-                        self.process_shooting_idea(slide)
-                else:
-                    print("未识别页面类型")
+    def process_file(self, filename, progress_callback=None, formats=("pdf",), low_memory=None,
+                     pdf_profile=None, tracer=None, output_dir=None, images_dir=None):
+        """处理单个PPTX文件，返回 {格式: 输出文件路径}
+
+        progress_callback: 可选，签名为 callback(stage, current_page, total_pages)，
+        stage 依次为 "parse"、"slide"（每页一次）、"assets"（导出图片，仅设置 images_dir 时）、
+        各输出格式名（如 "pdf"、"docx"）、"images"（准备图片）、"build"（排版写出文件）、"done"；
+        未设置回调时几乎没有额外开销
+        formats: 输出格式，取值见 RENDERERS
+        low_memory: 是否使用低内存模式；默认根据预估峰值内存与 LOW_MEMORY_THRESHOLD_MB 自动判断
+        pdf_profile: PDF 输出档位，取值见 PDF_PROFILES；默认 DEFAULT_PDF_PROFILE
+        tracer: 追踪记录器（如Web服务已记录上传区间）；默认按 TRACE_DIR / TRACE_SAMPLE_RATE 采样，结束时写出
+        output_dir: 输出目录（如共享存储）；默认写在PPTX文件旁
+        images_dir: 设置后先把图片按内容哈希导出到该目录（相对路径相对输出目录），JSON 引用这些文件
+        """
+        own_tracer = tracer is None
+        self.tracer = tracing.start_trace(os.path.basename(filename)) if own_tracer else tracer
+        pdf_profile = pdf_profile or DEFAULT_PDF_PROFILE
+        if pdf_profile not in PDF_PROFILES:
+            raise ValueError(f"不支持的PDF档位: {pdf_profile}")
+        self.pdf_profile = pdf_profile
+        self.progress_callback = progress_callback
+        self.current_file = filename
+        self.current_page = 0
+        rss_token = begin_peak_rss()
+        try:
+            with self.tracer.span("conversion", file=os.path.basename(filename)):
+                estimated = estimate_peak_memory(filename)
+                self.low_memory = estimated > LOW_MEMORY_THRESHOLD_MB if low_memory is None else low_memory
+                self.stats = {"estimated_memory_mb": round(estimated, 1), "low_memory": self.low_memory,
+                              "pdf_profile": pdf_profile}
+                if self.low_memory:
+                    logging.info(f"预估峰值内存 {estimated:.0f} MB，使用低内存模式")
             
-            # 生成输出文件名
-            output_filename = os.path.splitext(filename)[0] + "_拍摄需求.pdf"
-            self.generate_pdf(output_filename)
+                self.extract(filename)
             
-            # 打印提取内容摘要
-            self.print_summary()
+                # 生成输出文件
+                base_filename = os.path.splitext(filename)[0]
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                    base_filename = os.path.join(output_dir, os.path.basename(base_filename))
+                if images_dir:
+                    self.report_progress("assets")
+                    self.export_assets(os.path.join(os.path.dirname(base_filename), images_dir))
+                outputs = self.render(base_filename, formats)
             
-            print(f"\n{'='*50}")
-            print(f"完成处理: {filename}")
-            print(f"生成的文件：{output_filename}")
-            print(f"{'='*50}\n")
+                # 打印提取内容摘要
+                # 导出的图片直接读取导出文件，不再写入临时目录，两者合计为实际读取的图片数
+                self.stats["images_loaded"] = len(self.assets) + sum(
+                    isinstance(image, ImageRef) for image in self._spooled_images)
+                peak, exact = measure_peak_rss(rss_token)
+                self.stats["peak_rss_mb"] = round(peak, 1)
+                self.stats["peak_rss_exact"] = exact
+                logging.info(f"峰值内存: {self.stats['peak_rss_mb']} MB" + ("" if exact else "（进程整体，近似值）"))
+                self.print_summary()
+                self.report_progress("done")
             
+                print(f"\n{'='*50}")
+                print(f"完成处理: {filename}")
+                for output_filename in outputs.values():
+                    print(f"生成的文件：{output_filename}")
+                print(f"{'='*50}\n")
+                return outputs
+            
+        except ConversionCancelled:
+            logging.info(f"已取消处理文件: {filename}")
+            raise
         except Exception as e:
             logging.error(f"处理文件 {filename} 时发生错误: {e}")
             raise
+        finally:
+            end_peak_rss()
+            self.progress_callback = None
+            if own_tracer:
+                self.tracer.finish()
+            self.tracer = tracing.NULL_TRACER
+            self._spooled_images = {}
+            self.assets = {}
+            if self._spool_dir:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+                self._spool_dir = None
 
-    def generate_pdf(self, output_filename):
-        """生成PDF文档"""
-        doc = SimpleDocTemplate(
-            output_filename,
+    def prepare_image(self, image, width):
+        """按目标宽度计算图片尺寸，返回 (图片, 宽, 高)；同一次转换内各输出格式共用结果
+
+        尺寸只从图片头读取，不解码像素；JPEG/PNG/GIF 原样交给渲染器，其他格式才转换为PNG
+        """
+        key = (image, width)
+        if key not in self._prepared_images:
+            with self.tracer.span("prepare_image", image=getattr(image, "member", None)):
+                with PILImage.open(self.open_image(image)) as img:
+                    img_width, img_height = img.size
+                    fmt = img.format
+                if fmt not in PASSTHROUGH_FORMATS:
+                    image = self.convert_image(image)
+            
+            # 计算缩放后的尺寸
+            aspect = img_height / img_width
+            self._prepared_images[key] = (image, width, width * aspect)
+        return self._prepared_images[key]
+
+    def convert_image(self, image):
+        """将渲染器不支持的图片格式转换为PNG文件，返回文件路径"""
+        key = ("png", image)
+        if key not in self._spooled_images:
+            path = os.path.join(self.spool_dir(), f"converted_{len(self._spooled_images)}.png")
+            with PILImage.open(self.open_image(image)) as img:
+                has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+                img.convert("RGBA" if has_alpha else "RGB").save(path, "PNG")
+            self._spooled_images[key] = path
+            logging.info(f"图片格式 {image!r} 已转换为PNG")
+        return self._spooled_images[key]
+
+    def file_digest(self, path):
+        """图片文件的内容哈希（流式计算，同一次转换内缓存）"""
+        key = ("sha1", path)
+        if key not in self._spooled_images:
+            digest = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            self._spooled_images[key] = digest.hexdigest()
+        return self._spooled_images[key]
+
+    def pdf_image(self, image, width):
+        """按当前PDF档位返回要嵌入的图片文件
+
+        分辨率超过档位 DPI 时缩小并重新编码（不透明图片为JPEG，带透明通道的为PNG），否则原样嵌入；
+        内容相同的图片映射到同一个文件路径，reportlab 按路径复用同一个图片 XObject
+        """
+        source = self.open_image(image)
+        if not isinstance(source, str):
+            return source
+        profile = PDF_PROFILES[self.pdf_profile]
+        max_width = max(1, round(width / 72 * profile["dpi"]))
+        key = ("pdf", self.file_digest(source), max_width)
+        if key not in self._spooled_images:
+            with PILImage.open(source) as img:
+                if img.width <= max_width:
+                    self._spooled_images[key] = source
+                    return source
+                with self.tracer.span("downsample_image", width=img.width, target=max_width):
+                    size = (max_width, max(1, round(img.height * max_width / img.width)))
+                    if img.format == "JPEG":
+                        img.draft("RGB", size)  # JPEG 按缩小后的尺寸解码，减少解码开销
+                    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+                    resized = img.convert("RGBA" if has_alpha else "RGB").resize(size, PILImage.LANCZOS)
+                    name = f"pdf_{len(self._spooled_images)}"
+                    if has_alpha:
+                        path = os.path.join(self.spool_dir(), name + ".png")
+                        resized.save(path, "PNG", optimize=True)
+                    else:
+                        path = os.path.join(self.spool_dir(), name + ".jpg")
+                        resized.save(path, "JPEG", quality=profile["jpeg_quality"], optimize=True)
+            self._spooled_images[key] = path
+        return self._spooled_images[key]
+
+    def pdf_doc(self, target):
+        """按当前档位创建PDF文档模板，target 为文件名或可写对象"""
+        return SimpleDocTemplate(
+            target,
             pagesize=A4,
-            rightMargin=30,
-            leftMargin=30,
-            topMargin=30,
-            bottomMargin=30
-        )
-        
-        # 创建样式
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontName=self.font_name,
-            fontSize=28,
-            textColor=colors.black,  # 主标题使用黑色
-            spaceAfter=30,
-            alignment=1  # 居中
-        )
-        
-        heading_style = ParagraphStyle(
-            'CustomHeading',
-            parent=styles['Heading2'],
-            fontName=self.font_name,
-            fontSize=20,
-            textColor=colors.HexColor('#0066CC'),  # 其他标题使用蓝色
-            spaceAfter=20
-        )
-        
-        # 添加子标题样式
-        subheading_style = ParagraphStyle(
-            'CustomSubHeading',
-            parent=styles['Heading3'],
-            fontName=self.font_name,
-            fontSize=16,
-            textColor=colors.black,
-            spaceAfter=10,
-            spaceBefore=10
-        )
-        
-        normal_style = ParagraphStyle(
-            'CustomNormal',
-            parent=styles['Normal'],
-            fontName=self.font_name,
-            fontSize=12,
-            leading=20,
-            spaceAfter=10
+            rightMargin=PAGE_MARGIN,
+            leftMargin=PAGE_MARGIN,
+            topMargin=PAGE_MARGIN,
+            bottomMargin=PAGE_MARGIN,
+            pageCompression=1
         )
-        
-        bullet_style = ParagraphStyle(
-            'CustomBullet',
-            parent=styles['Normal'],
-            fontName=self.font_name,
-            fontSize=12,
-            leading=20,
-            leftIndent=20,
-            spaceAfter=5
-        )
-        
-        # 构建每页的内容
-        page_contents = []
+
+    def image_fingerprint(self, image):
+        """图片内容的标识，用作章节缓存键：ImageRef 取zip目录中的 CRC32 与大小，不读取图片数据"""
+        if image is None:
+            return None
+        if isinstance(image, ImageRef):
+            key = ("crc", image)
+            if key not in self._spooled_images:
+                with zipfile.ZipFile(image.path) as zf:
+                    info = zf.getinfo(image.member)
+                self._spooled_images[key] = f"{info.CRC:08x}-{info.file_size}"
+            return self._spooled_images[key]
+        if isinstance(image, str):
+            return self.file_digest(image)
+        return hashlib.sha1(image).hexdigest()
+
+    def pdf_sections(self):
+        """PDF 的五个章节，每章从新的一页开始：[(章节名, 章节输入数据, 生成 flowables 的函数)]
+
+        章节输入数据决定该章的排版结果（图片以内容标识代替），用作章节缓存键
+        """
+        # 获取样式（按字体缓存，进程内共享）
+        styles = get_pdf_styles(self.font_name)
+        title_style = styles["title"]
+        heading_style = styles["heading"]
+        subheading_style = styles["subheading"]
+        normal_style = styles["normal"]
+        bullet_style = styles["bullet"]
+        lazy = 2 if self.low_memory else 1
+        info = self.script_data["产品信息"]
         
         # 第1页：产品信息
-        page1 = []
-        page1.append(Paragraph("拍摄需求文档", title_style))
-        page1.append(Spacer(1, 20))
-        page1.append(Paragraph("1. 产品信息", heading_style))
-        page1.append(Paragraph(f"产品名称：{self.script_data['产品信息']['名称']}", normal_style))
-        page1.append(Paragraph(f"产品链接：{self.script_data['产品信息']['链接']}", normal_style))
-        
-        if self.script_data["产品信息"]["主图"]:
-            try:
-                img_data = BytesIO(self.script_data["产品信息"]["主图"])
-                img = PILImage.open(img_data)
-                img = img.convert('RGB')
-                
-                # 计算缩放后的尺寸
-                aspect = img.height / img.width
-                new_width = 4 * inch  # 设置图片宽度为4英寸
-                new_height = new_width * aspect
-                
-                # 添加产品图片
-                page1.append(Spacer(1, 10))
-                page1.append(Image(img_data, width=new_width, height=new_height))
-            except Exception as e:
-                logging.error(f"处理产品图片时发生错误: {e}")
-        
-        page_contents.append(page1)
-        
-        # 第2页：产品卖点
-        page2 = []
-        page2.append(Paragraph("2. 产品卖点", heading_style))
-        for point in self.script_data["产品卖点"]:
-            # 处理数字加粗
-            highlighted_point = self.highlight_numbers(point)
-            page2.append(Paragraph(f"• {highlighted_point}", bullet_style))
-        page_contents.append(page2)
-        
-        # 第3页：参考风格
-        page3 = []
-        page3.append(Paragraph("3. 参考风格", heading_style))
-        if self.script_data["参考风格"]:
-            # 创建三列布局的表格
-            images_data = []
-            current_row = []
-            column_width = doc.width / 3
+        def product_info():
+            page1 = []
+            page1.append(Paragraph("拍摄需求文档", title_style))
+            page1.append(Spacer(1, 20))
+            page1.append(Paragraph("1. 产品信息", heading_style))
+            page1.append(Paragraph(f"产品名称：{info['名称']}", normal_style))
+            page1.append(Paragraph(f"产品链接：{info['链接']}", normal_style))
             
-            for i, img_blob in enumerate(self.script_data["参考风格"]):
+            if info["主图"]:
                 try:
-                    img_data = BytesIO(img_blob)
-                    img = PILImage.open(img_data)
-                    img = img.convert('RGB')
-                    
-                    # 计算缩放后的尺寸
-                    aspect = img.height / img.width
-                    new_width = column_width
-                    new_height = new_width * aspect
+                    image, new_width, new_height = self.prepare_image(info["主图"], MAIN_IMAGE_WIDTH)
                     
-                    current_row.append(Image(img_data, width=new_width, height=new_height))
-                    
-                    if len(current_row) == 3:
-                        images_data.append(current_row)
-                        current_row = []
+                    # 添加产品图片
+                    page1.append(Spacer(1, 10))
+                    page1.append(Image(self.pdf_image(image, new_width), width=new_width, height=new_height,
+                                       lazy=lazy))
                 except Exception as e:
-                    logging.error(f"处理参考风格图片时发生错误: {e}")
-            
-            # 处理最后一行不足三列的情况
-            if current_row:
-                while len(current_row) < 3:
-                    current_row.append("")
-                images_data.append(current_row)
-            
-            if images_data:
-                # 创建表格并设置样式
-                table = Table(images_data, colWidths=[column_width] * 3)
-                table.setStyle(TableStyle([
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 5),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-                    ('TOPPADDING', (0, 0), (-1, -1), 5),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-                ]))
-                page3.append(table)
-        page_contents.append(page3)
+                    logging.error(f"处理产品图片时发生错误: {e}")
+                    self.stats["image_errors"] = self.stats.get("image_errors", 0) + 1
+            return page1
+        
+        # 第2页：产品卖点
+        def selling_points():
+            page2 = []
+            page2.append(Paragraph("2. 产品卖点", heading_style))
+            for point in self.script_data["产品卖点"]:
+                # 处理数字加粗
+                highlighted_point = self.highlight_numbers(point)
+                page2.append(Paragraph(f"• {highlighted_point}", bullet_style))
+            return page2
+        
+        # 第3页：参考风格
+        def reference_style():
+            page3 = []
+            page3.append(Paragraph("3. 参考风格", heading_style))
+            if self.script_data["参考风格"]:
+                # 创建三列布局的表格
+                images_data = []
+                current_row = []
+                column_width = REFERENCE_COLUMN_WIDTH
+                
+                for i, image in enumerate(self.script_data["参考风格"]):
+                    try:
+                        image, new_width, new_height = self.prepare_image(image, column_width)
+                        current_row.append(Image(self.pdf_image(image, new_width), width=new_width, height=new_height,
+                                                 lazy=lazy))
+                        
+                        if len(current_row) == 3:
+                            images_data.append(current_row)
+                            current_row = []
+                    except Exception as e:
+                        logging.error(f"处理参考风格图片时发生错误: {e}")
+                        self.stats["image_errors"] = self.stats.get("image_errors", 0) + 1
+                
+                # 处理最后一行不足三列的情况
+                if current_row:
+                    while len(current_row) < 3:
+                        current_row.append("")
+                    images_data.append(current_row)
+                
+                if images_data:
+                    # 创建表格并设置样式
+                    table = Table(images_data, colWidths=[column_width] * 3)
+                    table.setStyle(TableStyle([
+                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                        ('LEFTPADDING', (0, 0), (-1, -1), 5),
+                        ('RIGHTPADDING', (0, 0), (-1, -1), 5),
+                        ('TOPPADDING', (0, 0), (-1, -1), 5),
+                        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+                    ]))
+                    page3.append(table)
+            return page3
         
         # 第4页：布景要求
-        page4 = []
-        page4.append(Paragraph("4. 布景要求", heading_style))
-        for category, scenes in self.script_data["布景"].items():
-            if scenes:  # 只显示有内容的分类
-                page4.append(Paragraph(category, subheading_style))
-                for scene in sorted(scenes):
-                    # 为数字添加红色加粗样式
-                    highlighted_scene = self.highlight_numbers(scene)
-                    page4.append(Paragraph(f"• {highlighted_scene}", bullet_style))
-                page4.append(Spacer(1, 10))
-        page_contents.append(page4)
+        def scenes():
+            page4 = []
+            page4.append(Paragraph("4. 布景要求", heading_style))
+            for category, scenes in self.script_data["布景"].items():
+                if scenes:  # 只显示有内容的分类
+                    page4.append(Paragraph(category, subheading_style))
+                    for scene in sorted(scenes):
+                        # 为数字添加红色加粗样式
+                        highlighted_scene = self.highlight_numbers(scene)
+                        page4.append(Paragraph(f"• {highlighted_scene}", bullet_style))
+                    page4.append(Spacer(1, 10))
+            return page4
         
         # 第5页：道具清单
-        page5 = []
-        page5.append(Paragraph("5. 道具清单", heading_style))
-        
-        # 使用计数器来生成序号
-        counter = 1
-        for category, props in self.script_data["道具"].items():
-            if props:  # 只显示有内容的分类
-                page5.append(Paragraph(category, subheading_style))
-                sorted_props = sorted(props)  # 对道具进行排序
-                for prop in sorted_props:
-                    # 为数字添加红色加粗样式
-                    highlighted_prop = self.highlight_numbers(prop)
-                    # 使用数字序号替代原来的圆点
-                    page5.append(Paragraph(f"{counter}. {highlighted_prop}", bullet_style))
-                    counter += 1
-                page5.append(Spacer(1, 10))
+        def props():
+            page5 = []
+            page5.append(Paragraph("5. 道具清单", heading_style))
+            
+            # 使用计数器来生成序号
+            counter = 1
+            for category, props in self.script_data["道具"].items():
+                if props:  # 只显示有内容的分类
+                    page5.append(Paragraph(category, subheading_style))
+                    sorted_props = sorted(props)  # 对道具进行排序
+                    for prop in sorted_props:
+                        # 为数字添加红色加粗样式
+                        highlighted_prop = self.highlight_numbers(prop)
+                        # 使用数字序号替代原来的圆点
+                        page5.append(Paragraph(f"{counter}. {highlighted_prop}", bullet_style))
+                        counter += 1
+                    page5.append(Spacer(1, 10))
+            return page5
         
-        page_contents.append(page5)
+        return [
+            ("产品信息", [info["名称"], info["链接"], self.image_fingerprint(info["主图"])], product_info),
+            ("产品卖点", list(self.script_data["产品卖点"]), selling_points),
+            ("参考风格", [self.image_fingerprint(image) for image in self.script_data["参考风格"]], reference_style),
+            ("布景要求", [[category, sorted(scenes)] for category, scenes in self.script_data["布景"].items()], scenes),
+            ("道具清单", [[category, sorted(props)] for category, props in self.script_data["道具"].items()], props),
+        ]
+
+    def generate_pdf(self, output_filename):
+        """生成PDF文档，图片分辨率与JPEG质量按 self.pdf_profile 档位处理；
+        设置 PDF_SECTION_CACHE_DIR 时按章节缓存排版结果，只重新排版输入有变化的章节"""
+        sections = self.pdf_sections()
+        self.report_progress("images")
+        if PDF_SECTION_CACHE_DIR:
+            try:
+                import pypdf
+            except ImportError:
+                logging.warning("章节缓存需要安装 pypdf：pip install pypdf，本次完整排版")
+            else:
+                self.generate_pdf_from_sections(output_filename, sections, pypdf)
+                return
         
         # 构建最终文档内容
         story = []
-        for i, page_content in enumerate(page_contents):
-            # 添加页面内容
-            story.extend(page_content)
-            # 在每页之后添加分页符（最后一页除外）
-            if i < len(page_contents) - 1:
+        for i, (_, _, build) in enumerate(sections):
+            # 在每页之前添加分页符（第一页除外）
+            if i > 0:
                 story.append(PageBreak())
+            story.extend(build())
         
         # 生成PDF
-        doc.build(story)
+        self.report_progress("build")
+        with self.tracer.span("reportlab_build"):
+            self.pdf_doc(output_filename).build(story)
+
+    def generate_pdf_from_sections(self, output_filename, sections, pypdf):
+        """逐章排版为独立的PDF并按章节输入数据的哈希缓存，命中的章节直接拼接缓存的页面"""
+        os.makedirs(PDF_SECTION_CACHE_DIR, exist_ok=True)
+        prune_section_cache()
+        self.report_progress("build")
+        writer = pypdf.PdfWriter()
+        cached = 0
+        for name, data, build in sections:
+            key = hashlib.sha1(json.dumps(
+                [PDF_SECTION_CACHE_VERSION, name, self.pdf_profile, self.font_name, data], ensure_ascii=False
+            ).encode("utf-8")).hexdigest()
+            path = os.path.join(PDF_SECTION_CACHE_DIR, f"{key}.pdf")
+            if os.path.exists(path):
+                cached += 1
+                logging.info(f"章节“{name}”使用缓存的排版结果")
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                writer.append(path)
+                continue
+            errors = self.stats.get("image_errors", 0)
+            buffer = BytesIO()
+            with self.tracer.span("reportlab_build", section=name):
+                self.pdf_doc(buffer).build(build())
+            if self.stats.get("image_errors", 0) > errors:
+                # 排版时有图片处理失败被跳过，不缓存，下次重新排版
+                writer.append(BytesIO(buffer.getvalue()))
+                continue
+            # 先写临时文件再改名，并发转换不会读到写了一半的缓存
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(temp_path, path)
+            writer.append(path)
+        with self.tracer.span("splice_sections"):
+            # 合并各章节中相同的对象（如相同的字体数据）
+            writer.compress_identical_objects()
+            with open(output_filename, "wb") as f:
+                writer.write(f)
+        self.stats["pdf_sections"] = {"cached": cached, "rendered": len(sections) - cached}
+
+    def to_dict(self):
+        """返回可序列化的提取结果（集合转为有序列表，图片只记录数量）"""
+        return {
+            "产品信息": {
+                "名称": self.script_data["产品信息"]["名称"],
+                "链接": self.script_data["产品信息"]["链接"],
+                "主图": self.script_data["产品信息"]["主图"] is not None
+            },
+            "产品卖点": list(self.script_data["产品卖点"]),
+            "卖点数量": [list(quantity) for quantity in self.script_data["卖点数量"]],
+            "参考风格": len(self.script_data["参考风格"]),
+            "布景": {category: sorted(scenes) for category, scenes in self.script_data["布景"].items()},
+            "道具": {category: sorted(props) for category, props in self.script_data["道具"].items()}
+        }
+
+    def generate_json(self, output_filename):
+        """生成JSON（只输出提取结果，不读取图片数据）：图片已导出时引用导出的文件（相对JSON所在目录），
+        否则以PPTX内的部件路径引用"""
+        output_dir = os.path.dirname(os.path.abspath(output_filename))
+
+        def image_path(image):
+            if image in self.assets:
+                return os.path.relpath(self.assets[image], output_dir).replace(os.sep, "/")
+            return image.member
+
+        main_image = self.script_data["产品信息"]["主图"]
+        data = self.to_dict()
+        data["图片"] = {
+            "主图": image_path(main_image) if isinstance(main_image, ImageRef) else None,
+            "参考风格": [image_path(image) for image in self.script_data["参考风格"] if isinstance(image, ImageRef)]
+        }
+        with open(output_filename, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
 
     def print_summary(self):
         """打印提取内容摘要"""
@@ -537,6 +1279,8 @@ class ScriptGenerator:
         print("\n2. 产品卖点:")
         for point in self.script_data['产品卖点']:
             print(f"   - {point}")
+        for count, unit, item in self.script_data['卖点数量']:
+            print(f"     数量: {count} {unit} {item}")
             
         print(f"\n3. 参考风格片: {len(self.script_data['参考风格'])} 张")
         
@@ -548,42 +1292,370 @@ class ScriptGenerator:
                     print(f"   - {item}")
                     
         print("\n5. 道具信息:")
-        for category in ["装饰挂件", "装饰材料", "绿植类", "辅助工具", "套装类", "场景布置"]:
+        for category in self.rules.prop_category_names:
             if self.script_data["道具"][category]:
                 print(f"   {category}:")
                 for prop in self.script_data["道具"][category]:
                     print(f"   - {prop}")
+        
+        if self.stats:
+            print("\n6. 运行统计:")
+            print(f"   预估峰值内存: {self.stats['estimated_memory_mb']} MB"
+                  + ("（低内存模式）" if self.stats["low_memory"] else ""))
+            if self.stats["peak_rss_exact"]:
+                print(f"   实际峰值内存: {self.stats['peak_rss_mb']} MB")
+            else:
+                # 非 Linux 平台无法重置峰值，或同一进程中有并发转换
+                print(f"   进程峰值内存（近似，含进程内其他转换）: {self.stats['peak_rss_mb']} MB")
+            print(f"   读取图片: {self.stats['images_loaded']} 张")
+            if "assets" in self.stats:
+                assets = self.stats["assets"]
+                print(f"   导出图片: 写入 {assets['written']} 张，已存在跳过 {assets['skipped']} 张（{assets['dir']}）")
+            for fmt, output in self.stats.get("outputs", {}).items():
+                label = f"{fmt}（{self.stats['pdf_profile']}）" if fmt == "pdf" else fmt
+                sections = self.stats.get("pdf_sections")
+                if fmt == "pdf" and sections:
+                    label += f"（章节缓存命中 {sections['cached']}/{sections['cached'] + sections['rendered']}）"
+                print(f"   输出 {label}: {output['size_kb']} KB，用时 {output['seconds']} 秒")
+            hits = self.stats.get("text_cache_hits", 0)
+            misses = self.stats.get("text_cache_misses", 0)
+            if hits + misses:
+                print(f"   文本分析缓存: 命中 {hits}/{hits + misses}（{hits / (hits + misses):.0%}），"
+                      f"累计命中率 {TEXT_ANALYSIS_CACHE.hit_rate():.0%}")
+
+    def split_numbers(self, text):
+        """将文本切分为 [(片段, 是否高亮)]，PDF 与 DOCX 的数字高亮共用此规则（见 quantities.scan）"""
+        return quantities.parse(text).segments
 
     def highlight_numbers(self, text):
         """为文本中的数字添加红色加粗样式"""
         if not text:
             return text
         
-        # 定义中文数字映射
-        chinese_nums = {
-            '零': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9,
-            '十': 10, '百': 100, '千': 1000, '万': 10000, '亿': 100000000
-        }
+        return "".join(
+            f'<b><font color="{NUMBER_COLOR}">{segment}</font></b>' if is_number else segment
+            for segment, is_number in self.split_numbers(text)
+        )
+
+    def generate_docx(self, output_filename):
+        """生成DOCX文档（可编辑版本，内容与PDF一致）"""
+        try:
+            from docx import Document
+            from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
+            from docx.shared import Pt, RGBColor
+            from docx.oxml.ns import qn
+        except ImportError:
+            raise RuntimeError("生成DOCX需要安装 python-docx：pip install python-docx")
+        
+        document = Document()
+        section = document.sections[0]
+        section.left_margin = section.right_margin = Pt(PAGE_MARGIN)
+        section.top_margin = section.bottom_margin = Pt(PAGE_MARGIN)
         
-        # 创建中文数字的正则表达式模式
-        chinese_pattern = f"[{''.join(chinese_nums.keys())}]+"
+        # 设置默认字体（包括东亚字体）
+        normal = document.styles['Normal']
+        normal.font.name = self.font_name
+        normal.font.size = Pt(12)
+        normal.element.rPr.rFonts.set(qn('w:eastAsia'), self.font_name)
         
-        # 先处理阿拉伯数字
-        text = re.sub(r'(\d+)', r'<b><font color="red">\1</font></b>', text)
+        heading_color = RGBColor.from_string(HEADING_COLOR.lstrip('#'))
+        number_color = RGBColor(0xFF, 0x00, 0x00)
         
-        # 再处理中文数字
-        def replace_chinese_num(match):
-            return f'<b><font color="red">{match.group(0)}</font></b>'
+        def add_text(text, size=12, bold=False, color=None, align=None, prefix=""):
+            """添加段落，数字按高亮规则显示为红色加粗"""
+            paragraph = document.add_paragraph()
+            if align is not None:
+                paragraph.alignment = align
+            segments = [(text, False)] if color is not None else self.split_numbers(text)
+            if prefix:
+                segments.insert(0, (prefix, False))
+            for segment, is_number in segments:
+                run = paragraph.add_run(segment)
+                run.font.size = Pt(size)
+                run.bold = bold or is_number
+                if is_number:
+                    run.font.color.rgb = number_color
+                elif color is not None:
+                    run.font.color.rgb = color
+            return paragraph
         
-        text = re.sub(chinese_pattern, replace_chinese_num, text)
+        def page_break():
+            document.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+        
+        # 第1页：产品信息
+        add_text("拍摄需求文档", size=28, bold=True, align=WD_ALIGN_PARAGRAPH.CENTER, color=RGBColor(0, 0, 0))
+        add_text("1. 产品信息", size=20, color=heading_color)
+        add_text(f"产品名称：{self.script_data['产品信息']['名称']}", color=RGBColor(0, 0, 0))
+        add_text(f"产品链接：{self.script_data['产品信息']['链接']}", color=RGBColor(0, 0, 0))
+        self.report_progress("images")
+        if self.script_data["产品信息"]["主图"]:
+            try:
+                image, new_width, new_height = self.prepare_image(
+                    self.script_data["产品信息"]["主图"], MAIN_IMAGE_WIDTH)
+                document.add_picture(self.open_image(image), width=Pt(new_width), height=Pt(new_height))
+            except Exception as e:
+                logging.error(f"处理产品图片时发生错误: {e}")
+        page_break()
+        
+        # 第2页：产品卖点
+        add_text("2. 产品卖点", size=20, color=heading_color)
+        for point in self.script_data["产品卖点"]:
+            add_text(point, prefix="• ")
+        page_break()
+        
+        # 第3页：参考风格（三列表格）
+        add_text("3. 参考风格", size=20, color=heading_color)
+        images = []
+        for image in self.script_data["参考风格"]:
+            try:
+                images.append(self.prepare_image(image, REFERENCE_COLUMN_WIDTH))
+            except Exception as e:
+                logging.error(f"处理参考风格图片时发生错误: {e}")
+        if images:
+            table = document.add_table(rows=(len(images) + 2) // 3, cols=3)
+            for i, (image, new_width, new_height) in enumerate(images):
+                cell = table.cell(i // 3, i % 3)
+                paragraph = cell.paragraphs[0]
+                paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                # 单元格留出内边距
+                scale = (new_width - 10) / new_width
+                paragraph.add_run().add_picture(
+                    self.open_image(image), width=Pt(new_width * scale), height=Pt(new_height * scale))
+        page_break()
+        
+        # 第4页：布景要求
+        add_text("4. 布景要求", size=20, color=heading_color)
+        for category, scenes in self.script_data["布景"].items():
+            if scenes:  # 只显示有内容的分类
+                add_text(category, size=16, color=RGBColor(0, 0, 0))
+                for scene in sorted(scenes):
+                    add_text(scene, prefix="• ")
+        page_break()
+        
+        # 第5页：道具清单
+        add_text("5. 道具清单", size=20, color=heading_color)
+        counter = 1
+        for category, props in self.script_data["道具"].items():
+            if props:  # 只显示有内容的分类
+                add_text(category, size=16, color=RGBColor(0, 0, 0))
+                for prop in sorted(props):
+                    add_text(prop, prefix=f"{counter}. ")
+                    counter += 1
         
-        return text
+        self.report_progress("build")
+        document.save(output_filename)
+
+# 输出格式注册表：格式名 -> (输出文件名后缀, 渲染函数 func(generator, output_filename))
+RENDERERS = {
+    "pdf": ("_拍摄需求.pdf", ScriptGenerator.generate_pdf),
+    "docx": ("_拍摄需求.docx", ScriptGenerator.generate_docx),
+    "json": ("_拍摄需求.json", ScriptGenerator.generate_json),
+}
+
+def register_renderer(fmt, suffix, render_func):
+    """注册新的输出格式，render_func 接收 (generator, output_filename)，读取 generator.script_data"""
+    RENDERERS[fmt] = (suffix, render_func)
+
+def inspect_deck(path):
+    """检查单个文件（供进程池调用），失败时返回错误信息而不抛出"""
+    try:
+        return ScriptGenerator().inspect(path)
+    except Exception as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}"}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="处理当前目录下的PPTX文件，生成拍摄需求文档")
+    parser.add_argument("-f", "--format", dest="formats", action="append", choices=sorted(RENDERERS),
+                        help="输出格式，可重复指定（默认 pdf）")
+    # 默认 None：转换时取 DEFAULT_PDF_PROFILE；加入队列时不指定则由 worker 决定
+    parser.add_argument("--pdf-profile", choices=sorted(PDF_PROFILES),
+                        help=f"PDF输出档位：draft/screen/print，控制图片分辨率与JPEG质量（默认 {DEFAULT_PDF_PROFILE}）")
+    parser.add_argument("--export-images", nargs="?", const="images", metavar="DIR",
+                        help="把图片按内容哈希以原始格式导出到输出文件旁的目录（默认 images），JSON引用导出的文件")
+    parser.add_argument("--profile", action="store_true",
+                        help="使用 cProfile 分析每个文件的转换，在输出文件旁生成 _profile.prof 和 _profile.txt")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    corpus_parser = subparsers.add_parser("corpus", help="递归处理目录树，提取结果写入SQLite索引")
+    corpus_parser.add_argument("root", help="PPTX文件所在的根目录")
+    corpus_parser.add_argument("--db", default="corpus.sqlite", help="SQLite数据库路径（默认 corpus.sqlite）")
+    corpus_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="并行进程数")
+    # default=SUPPRESS：未在子命令后指定时保留主命令上的 -f（如 "-f json corpus DIR"）
+    corpus_parser.add_argument("-f", "--format", dest="formats", action="append", choices=sorted(RENDERERS),
+                               default=argparse.SUPPRESS,
+                               help="同时在原文件旁生成的文档格式，可重复指定，也可写在子命令之前（默认只建索引）")
+    corpus_parser.add_argument("--force", action="store_true", help="重新处理未修改过的文件")
+    
+    search_parser = subparsers.add_parser("search", help="检索索引中的道具、布景、产品名称和卖点")
+    search_parser.add_argument("query", help="查询词，空格分隔为 AND，可用 OR 连接，如 \"花环 OR 剪刀\"")
+    search_parser.add_argument("--db", default="corpus.sqlite", help="SQLite数据库路径（默认 corpus.sqlite）")
+    search_parser.add_argument("--kind", choices=["product", "selling_point", "scene", "prop"], help="只检索某一类内容")
+    search_parser.add_argument("--category", help="只检索某一类别，如 装饰挂件、拍摄场景")
+    search_parser.add_argument("--month", help="只检索某月的文件，格式 YYYY-MM")
+    search_parser.add_argument("--limit", type=int, default=50, help="最多返回条数（默认 50）")
+    search_parser.add_argument("--json", action="store_true", help="以JSON格式输出")
+    
+    trace_parser = subparsers.add_parser("trace-summary", help="汇总目录下的追踪文件，列出最慢的区间")
+    trace_parser.add_argument("directory", help="追踪文件目录（TRACE_DIR）")
+    trace_parser.add_argument("--top", type=int, default=20, help="列出耗时最长的单个区间数（默认 20）")
+    
+    inspect_parser = subparsers.add_parser("inspect", help="只解析不输出，逐页报告识别结果与提取内容（JSON Lines），用于排查模板变化")
+    inspect_parser.add_argument("paths", nargs="+", help="PPTX文件或目录（目录递归查找）")
+    inspect_parser.add_argument("-j", "--jobs", type=int, default=1, help="并行进程数（默认 1）")
+    inspect_parser.add_argument("--pretty", action="store_true", help="缩进输出，便于人工阅读")
+    
+    enqueue_parser = subparsers.add_parser("enqueue", help="把PPTX文件（或目录下的全部PPTX）加入共享任务队列")
+    enqueue_parser.add_argument("paths", nargs="+", help="PPTX文件或目录；路径需在所有 worker 上可访问")
+    enqueue_parser.add_argument("--db", default="queue.sqlite", help="队列数据库路径（默认 queue.sqlite）")
+    enqueue_parser.add_argument("-o", "--output-dir", help="输出目录（默认写在PPTX文件旁）")
+    # 与主命令的 -f / --pdf-profile 共用同一 dest，default=SUPPRESS 避免覆盖写在子命令之前的值
+    enqueue_parser.add_argument("-f", "--format", dest="formats", action="append", choices=sorted(RENDERERS),
+                                default=argparse.SUPPRESS, help="输出格式，可重复指定，也可写在子命令之前（默认 pdf）")
+    enqueue_parser.add_argument("--pdf-profile", choices=sorted(PDF_PROFILES), default=argparse.SUPPRESS,
+                                help="PDF输出档位（默认由 worker 的 PDF_PROFILE 决定）")
+    enqueue_parser.add_argument("--max-attempts", type=int, default=3, help="每个任务的最大尝试次数（默认 3）")
+    
+    worker_parser = subparsers.add_parser("worker", help="从共享任务队列领取并处理任务，可在多台机器上同时运行")
+    worker_parser.add_argument("--db", default="queue.sqlite", help="队列数据库路径（默认 queue.sqlite）")
+    worker_parser.add_argument("-j", "--jobs", type=int, default=1, help="本机启动的 worker 进程数（默认 1）")
+    worker_parser.add_argument("--lease", type=int, default=120,
+                               help="租约秒数：worker 失联超过该时间后任务交给其他 worker 重试（默认 120）")
+    worker_parser.add_argument("--exit-when-empty", action="store_true", help="队列为空时退出（默认持续等待新任务）")
+    
+    queue_parser = subparsers.add_parser("queue-status", help="查看共享任务队列各状态的任务数和失败原因")
+    queue_parser.add_argument("--db", default="queue.sqlite", help="队列数据库路径（默认 queue.sqlite）")
+    
+    args = parser.parse_args()
+    
+    if args.command == "inspect":
+        from concurrent.futures import ProcessPoolExecutor
+        import corpus
+        # 结果输出到 stdout，日志只保留警告和错误
+        logging.getLogger().setLevel(logging.WARNING)
+        paths = []
+        for path in args.paths:
+            paths.extend(corpus.find_decks(path) if os.path.isdir(path) else [path])
+        start = time.perf_counter()
+        failed = 0
+        if args.jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=args.jobs)
+            results = executor.map(inspect_deck, paths, chunksize=8)
+        else:
+            executor = None
+            results = map(inspect_deck, paths)
+        for result in results:
+            failed += "error" in result
+            print(json.dumps(result, ensure_ascii=False, indent=2 if args.pretty else None), flush=True)
+        if executor is not None:
+            executor.shutdown()
+        print(f"检查 {len(paths)} 个文件，失败 {failed} 个，用时 {time.perf_counter() - start:.2f} 秒", file=sys.stderr)
+        sys.exit(1 if failed else 0)
+    
+    if args.command == "enqueue":
+        import corpus
+        import workqueue
+        conn = workqueue.open_queue(args.db)
+        total = added = 0
+        for path in args.paths:
+            # 目录下的文件在输出目录中保留相对目录结构
+            is_dir = os.path.isdir(path)
+            paths = list(corpus.find_decks(path)) if is_dir else [path]
+            total += len(paths)
+            added += workqueue.enqueue(conn, paths, formats=args.formats or ["pdf"], output_dir=args.output_dir,
+                                       pdf_profile=args.pdf_profile, max_attempts=args.max_attempts,
+                                       root=path if is_dir else None)
+        conn.close()
+        print(f"已加入队列 {added} 个任务（跳过 {total - added} 个已在队列中的文件）")
+        sys.exit(0)
+    
+    if args.command == "worker":
+        import multiprocessing
+        import workqueue
+        kwargs = {"lease_seconds": args.lease, "exit_when_empty": args.exit_when_empty}
+        if args.jobs <= 1:
+            try:
+                workqueue.run_worker(args.db, **kwargs)
+            except KeyboardInterrupt:
+                pass
+            sys.exit(0)
+        workers = [multiprocessing.Process(target=workqueue.run_worker, args=(args.db,), kwargs=kwargs)
+                   for _ in range(args.jobs)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.join()
+        sys.exit(0)
+    
+    if args.command == "queue-status":
+        import workqueue
+        conn = workqueue.open_queue(args.db)
+        counts = workqueue.status_counts(conn)
+        failed = workqueue.failed_jobs(conn)
+        conn.close()
+        print("，".join(f"{status} {counts.get(status, 0)}" for status in
+                       (workqueue.QUEUED, workqueue.RUNNING, workqueue.DONE, workqueue.FAILED)))
+        for path, attempts, error in failed:
+            print(f"  失败（{attempts} 次）: {path}  {error}")
+        sys.exit(0)
+    
+    if args.command == "trace-summary":
+        summary = tracing.summarize(args.directory, top=args.top)
+        print(f"追踪文件: {summary['traces']} 个\n")
+        print(f"{'区间':<30}{'次数':>8}{'总耗时ms':>12}{'平均ms':>10}{'最大ms':>10}")
+        for name, stats in summary["spans"]:
+            print(f"{name:<30}{stats['count']:>8}{stats['total_ms']:>12.1f}{stats['mean_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+        print(f"\n最慢的 {len(summary['slowest'])} 个区间:")
+        for dur_ms, name, trace, path in summary["slowest"]:
+            print(f"  {dur_ms:>10.1f} ms  {name}  ({trace}, {path})")
+        sys.exit(0)
+    
+    if args.command == "search":
+        import corpus
+        import search
+        conn = corpus.open_db(args.db)
+        start = time.perf_counter()
+        result = search.search(conn, args.query, kind=args.kind, category=args.category,
+                               month=args.month, limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        conn.close()
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            for item in result["results"]:
+                print(f"{item['date']}  [{item['kind']}/{item['category'] or '-'}] {item['text']}  ← {item['path']}")
+            print(f"\n共 {sum(result['facets']['kind'].values())} 条匹配，用时 {elapsed:.1f} ms")
+            for name, counts in result["facets"].items():
+                if counts:
+                    print(f"{name}: " + "，".join(f"{value} {count}" for value, count in counts.items()))
+        sys.exit(0)
+    
+    if args.command == "corpus":
+        import corpus
+        try:
+            if args.formats:
+                register_font()
+        except Exception as e:
+            logging.error(f"加载字体失败: {e}")
+            sys.exit(1)
+        summary = corpus.convert_corpus(args.root, args.db, jobs=args.jobs,
+                                        formats=args.formats or (), force=args.force)
+        print(f"\n完成: 成功 {summary['ok']}，失败 {summary['error']}，跳过 {summary['skipped']}")
+        lookups = summary["text_cache_hits"] + summary["text_cache_misses"]
+        if lookups:
+            print(f"文本分析缓存命中率: {summary['text_cache_hits'] / lookups:.0%}"
+                  f"（命中 {summary['text_cache_hits']}/{lookups}）")
+        print(f"索引数据库：{args.db}")
+        sys.exit(1 if summary["error"] else 0)
+    
+    formats = args.formats or ["pdf"]
+    
     # 注册字体
-    font_path = "/System/Library/Fonts/STHeiti Light.ttc"
     try:
-        pdfmetrics.registerFont(TTFont("STHeiti", font_path))
+        register_font()
         print(f"\n成功加载字体: STHeiti")
     except Exception as e:
         logging.error(f"加载字体失败: {e}")
@@ -608,4 +1680,13 @@ if __name__ == "__main__":
         print(f"\n{'='*50}")
         print(f"开始处理文件: {filename}")
         print(f"{'='*50}")
-        generator.process_file(filename) 
\ No newline at end of file
+        if args.profile:
+            profile_call(os.path.splitext(filename)[0], generator.process_file, filename, formats=formats,
+                         pdf_profile=args.pdf_profile, images_dir=args.export_images)
+        else:
+            generator.process_file(filename, formats=formats, pdf_profile=args.pdf_profile,
+                                   images_dir=args.export_images)
+    
+    if TEXT_ANALYSIS_CACHE.hits + TEXT_ANALYSIS_CACHE.misses:
+        print(f"文本分析缓存累计命中率: {TEXT_ANALYSIS_CACHE.hit_rate():.0%}"
+              f"（命中 {TEXT_ANALYSIS_CACHE.hits}，未命中 {TEXT_ANALYSIS_CACHE.misses}）") 
\ No newline at end of file
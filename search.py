@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+
+# 全文索引：search_entries 保存每条可检索内容，search_fts 以外部内容方式对 tokens 列建立 FTS5 索引。
+# 中文按二元组（bigram）切词，英文/数字按单词切分，使两个字的查询（如“花环”“剪刀”）也能命中索引。
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_entries (
+    id INTEGER PRIMARY KEY,
+    deck_id INTEGER NOT NULL REFERENCES decks(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    category TEXT,
+    text TEXT NOT NULL,
+    tokens TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_search_entries_deck ON search_entries(deck_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+    tokens, content='search_entries', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS search_entries_ai AFTER INSERT ON search_entries BEGIN
+    INSERT INTO search_fts (rowid, tokens) VALUES (new.id, new.tokens);
+END;
+CREATE TRIGGER IF NOT EXISTS search_entries_ad AFTER DELETE ON search_entries BEGIN
+    INSERT INTO search_fts (search_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+END;
+"""
+
+# 可检索内容的类型
+KINDS = ("product", "selling_point", "scene", "prop")
+
+# 中文连续片段 / 英文数字单词
+_CJK_RUN = re.compile(r"[㐀-鿿豈-﫿]+")
+_WORD_RUN = re.compile(r"[㐀-鿿豈-﫿]+|[0-9A-Za-z]+")
+
+def tokenize(text):
+    """切词：中文片段输出全部二元组并补上末字（单字查询可用前缀匹配命中），其余按单词小写输出"""
+    tokens = []
+    for match in _WORD_RUN.finditer(text):
+        run = match.group(0)
+        if _CJK_RUN.fullmatch(run):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run.lower())
+    return " ".join(tokens)
+
+def _term_query(term):
+    """把一个查询词转换为 FTS5 表达式，词内各片段之间为 AND 关系"""
+    parts = []
+    for match in _WORD_RUN.finditer(term):
+        run = match.group(0)
+        if not _CJK_RUN.fullmatch(run):
+            parts.append(f'"{run.lower()}"')
+        elif len(run) == 1:
+            parts.append(f'"{run}" *')
+        else:
+            parts.append('"' + " ".join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+    return " AND ".join(parts)
+
+def build_match(query):
+    """解析查询：空格分隔的词之间为 AND，可用 OR（或 |）连接备选词，如“花环 OR 剪刀”"""
+    groups = [[]]
+    for term in query.replace("|", " OR ").split():
+        if term.upper() == "OR":
+            groups.append([])
+            continue
+        expr = _term_query(term)
+        if expr:
+            groups[-1].append(f"({expr})")
+    clauses = [" AND ".join(group) for group in groups if group]
+    if not clauses:
+        return None
+    return " OR ".join(f"({clause})" for clause in clauses)
+
+def index_record(conn, deck_id, record):
+    """写入一个文件的可检索内容；旧内容随 decks 行删除时级联清除"""
+    entries = []
+    if record["产品信息"]["名称"]:
+        entries.append(("product", None, record["产品信息"]["名称"]))
+    entries.extend(("selling_point", None, point) for point in record["产品卖点"])
+    entries.extend(("scene", category, scene)
+                   for category, scenes in record["布景"].items() for scene in scenes)
+    entries.extend(("prop", category, prop)
+                   for category, props in record["道具"].items() for prop in props)
+    conn.executemany(
+        "INSERT INTO search_entries (deck_id, kind, category, text, tokens) VALUES (?, ?, ?, ?, ?)",
+        [(deck_id, kind, category, text, tokenize(text)) for kind, category, text in entries]
+    )
+
+def search(conn, query, kind=None, category=None, month=None, limit=50):
+    """全文检索，返回 {"results": [...], "facets": {...}}
+
+    kind/category/month（YYYY-MM，按文件修改时间）为可选筛选条件；
+    facets 给出命中结果按类型、类别、月份的分布。
+    """
+    match = build_match(query)
+    if match is None:
+        return {"results": [], "facets": {"kind": {}, "category": {}, "month": {}}}
+
+    where = ["search_fts MATCH ?"]
+    params = [match]
+    if kind:
+        where.append("e.kind = ?")
+        params.append(kind)
+    if category:
+        where.append("e.category = ?")
+        params.append(category)
+    if month:
+        where.append("strftime('%Y-%m', d.mtime, 'unixepoch', 'localtime') = ?")
+        params.append(month)
+    base = (
+        "FROM search_fts JOIN search_entries e ON e.id = search_fts.rowid "
+        "JOIN decks d ON d.id = e.deck_id WHERE " + " AND ".join(where)
+    )
+
+    rows = conn.execute(
+        "SELECT d.path, d.product_name, e.kind, e.category, e.text, "
+        "strftime('%Y-%m-%d', d.mtime, 'unixepoch', 'localtime') "
+        + base + " ORDER BY d.mtime DESC, e.id LIMIT ?",
+        params + [limit]
+    ).fetchall()
+    results = [
+        {"path": path, "product": product, "kind": kind_, "category": category_, "text": text, "date": date}
+        for path, product, kind_, category_, text, date in rows
+    ]
+
+    facets = {}
+    for name, column in (("kind", "e.kind"),
+                         ("category", "e.category"),
+                         ("month", "strftime('%Y-%m', d.mtime, 'unixepoch', 'localtime')")):
+        facets[name] = {
+            value: count for value, count in conn.execute(
+                f"SELECT {column}, COUNT(*) " + base + f" AND {column} IS NOT NULL "
+                f"GROUP BY {column} ORDER BY COUNT(*) DESC",
+                params
+            )
+        }
+    return {"results": results, "facets": facets}
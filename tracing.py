@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import glob
+import time
+import heapq
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+# 追踪文件目录；未设置时不记录追踪
+TRACE_DIR = os.environ.get("TRACE_DIR")
+# 采样率（0~1）：生产环境可设为较小的值长期开启
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))
+# 输出格式：jsonl（每行一个 span）或 chrome（chrome://tracing / Perfetto 可直接打开）
+TRACE_FORMAT = os.environ.get("TRACE_FORMAT", "jsonl")
+TRACE_FORMATS = ("jsonl", "chrome")
+
+
+class Span:
+    """一个计时区间；name 和 args 可在区间结束前修改（如识别出页面类型后改名）"""
+
+    __slots__ = ("name", "args", "start", "end", "depth")
+
+    def __init__(self, name, args, start, depth):
+        self.name = name
+        self.args = args
+        self.start = start
+        self.end = None
+        self.depth = depth
+
+    def rename(self, name):
+        self.name = name
+
+
+class Tracer:
+    """记录一次转换中的嵌套区间，结束时写入 TRACE_DIR"""
+
+    enabled = True
+
+    def __init__(self, name, trace_dir=None, fmt=None):
+        self.name = name
+        self.trace_dir = trace_dir or TRACE_DIR
+        self.fmt = fmt or TRACE_FORMAT
+        if self.fmt not in TRACE_FORMATS:
+            raise ValueError(f"不支持的追踪格式: {self.fmt}")
+        self.spans = []
+        self._stack = []
+        # 以墙钟时间为起点，单调时钟计时
+        self._origin_wall = time.time()
+        self._origin = time.perf_counter()
+
+    def _now(self):
+        return time.perf_counter() - self._origin
+
+    @contextmanager
+    def span(self, name, **args):
+        """记录一个区间，可嵌套"""
+        span = Span(name, args, self._now(), len(self._stack))
+        self.spans.append(span)
+        self._stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.args["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = self._now()
+            self._stack.pop()
+
+    def add_span(self, name, start_wall, end_wall, **args):
+        """补记发生在追踪开始之前或其他请求中的区间（如分块上传），时间为 time.time()"""
+        span = Span(name, args, start_wall - self._origin_wall, len(self._stack))
+        span.end = end_wall - self._origin_wall
+        self.spans.append(span)
+
+    def records(self):
+        """返回已结束区间的字典列表，时间单位为毫秒，start 相对追踪开始时间"""
+        return [
+            {"trace": self.name, "name": span.name, "start_ms": round(span.start * 1000, 3),
+             "dur_ms": round((span.end - span.start) * 1000, 3), "depth": span.depth, "args": span.args}
+            for span in self.spans if span.end is not None
+        ]
+
+    def finish(self):
+        """写出追踪文件，返回文件路径；写出失败只记录日志并返回 None，不影响转换结果"""
+        try:
+            return self._write()
+        except Exception as e:
+            logging.error(f"写出追踪文件失败: {e}")
+            return None
+
+    def _write(self):
+        """写出追踪文件，返回文件路径"""
+        os.makedirs(self.trace_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._origin_wall))
+        safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in self.name)
+        base = os.path.join(self.trace_dir, f"{stamp}_{os.getpid()}_{threading.get_ident()}_{safe_name}")
+        if self.fmt == "chrome":
+            path = base + ".trace.json"
+            events = [
+                {"name": record["name"], "cat": "conversion", "ph": "X",
+                 "ts": round(self._origin_wall * 1e6 + record["start_ms"] * 1000),
+                 "dur": round(record["dur_ms"] * 1000), "pid": os.getpid(), "tid": threading.get_ident(),
+                 "args": dict(record["args"], trace=self.name)}
+                for record in self.records()
+            ]
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        else:
+            path = base + ".trace.jsonl"
+            with open(path, "w", encoding="utf-8") as f:
+                for record in self.records():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        logging.info(f"追踪结果: {path}")
+        return path
+
+
+class _NullSpan:
+    """空区间，同时充当自身的上下文管理器，避免每次创建生成器"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def rename(self, name):
+        pass
+
+
+class NullTracer:
+    """未采样时使用：所有操作都是空操作，开销可忽略"""
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, **args):
+        return self._span
+
+    def add_span(self, name, start_wall, end_wall, **args):
+        pass
+
+    def finish(self):
+        return None
+
+
+NULL_TRACER = NullTracer()
+
+def start_trace(name, sample_rate=None):
+    """按采样率决定本次转换是否记录追踪，返回 Tracer 或 NULL_TRACER；未设置 TRACE_DIR 时不记录"""
+    if not TRACE_DIR:
+        return NULL_TRACER
+    sample_rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if random.random() >= sample_rate:
+        return NULL_TRACER
+    return Tracer(name)
+
+def load_trace(path):
+    """读取一个追踪文件（两种格式均可），返回 span 字典列表"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        events = json.load(f)["traceEvents"]
+    return [
+        {"trace": event["args"].get("trace", os.path.basename(path)), "name": event["name"],
+         "dur_ms": event["dur"] / 1000, "args": event["args"]}
+        for event in events if event.get("ph") == "X"
+    ]
+
+def summarize(directory, top=20):
+    """汇总目录下全部追踪文件：各区间名称的次数/总耗时/平均/最大，以及耗时最长的单个区间"""
+    paths = sorted(glob.glob(os.path.join(directory, "*.trace.jsonl")) +
+                   glob.glob(os.path.join(directory, "*.trace.json")))
+    by_name = {}
+    slowest = []  # 最小堆，只保留耗时最长的 top 个区间
+    for path in paths:
+        for record in load_trace(path):
+            stats = by_name.setdefault(record["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += record["dur_ms"]
+            stats["max_ms"] = max(stats["max_ms"], record["dur_ms"])
+            item = (record["dur_ms"], record["name"], record["trace"], os.path.basename(path))
+            if len(slowest) < top:
+                heapq.heappush(slowest, item)
+            elif item > slowest[0]:
+                heapq.heapreplace(slowest, item)
+    for stats in by_name.values():
+        stats["mean_ms"] = stats["total_ms"] / stats["count"]
+    return {
+        "traces": len(paths),
+        "spans": sorted(by_name.items(), key=lambda item: item[1]["total_ms"], reverse=True),
+        "slowest": sorted(slowest, reverse=True),
+    }
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from script_generator import ScriptGenerator, register_font
+
+# 任务队列：多台机器共享同一个数据库文件（放在共享文件系统上），各自运行 worker 领取任务。
+# 领取任务时获得租约，处理期间定时续约；worker 崩溃后租约过期，任务自动回到队列重试。
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    output_dir TEXT,
+    formats TEXT NOT NULL,
+    pdf_profile TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    outputs TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_output_dir ON jobs(output_dir);
+"""
+
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# 默认租约时长（秒），续约间隔为租约的三分之一
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2
+
+def open_queue(db_path):
+    """打开（必要时创建）任务队列数据库
+
+    使用回滚日志而不是 WAL：WAL 依赖同一台机器上的共享内存，多台机器通过共享文件系统访问时不可用
+    """
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.executescript(SCHEMA)
+    return conn
+
+def default_worker_id():
+    """worker 标识：主机名与进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _job_output_dir(path, output_dir, root=None):
+    """任务的输出目录：保留文件相对 root 的目录结构"""
+    if root is not None:
+        relative = os.path.relpath(os.path.dirname(path), os.path.abspath(root))
+        if not relative.startswith(os.pardir):
+            output_dir = os.path.join(output_dir, relative)
+    return os.path.normpath(output_dir)
+
+def _output_taken(conn, path, output_dir):
+    """输出目录中是否已有其他同名PPTX的任务（输出文件会互相覆盖）"""
+    name = os.path.basename(path)
+    return any(os.path.basename(other) == name and other != path for (other,) in conn.execute(
+        "SELECT path FROM jobs WHERE output_dir = ?", (output_dir,)))
+
+def enqueue(conn, paths, formats=("pdf",), output_dir=None, pdf_profile=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+            root=None):
+    """添加任务，返回新增的任务数；已在排队或处理中的同一文件不重复添加
+
+    output_dir 下保留各文件相对 root（通常是加入队列的目录）的目录结构；
+    不同位置的同名文件会输出到同一目录时，后加入的任务输出到以任务号命名的子目录，避免互相覆盖
+    """
+    added = 0
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for path in paths:
+            path = os.path.abspath(path)
+            pending = conn.execute(
+                "SELECT 1 FROM jobs WHERE path = ? AND status IN (?, ?)", (path, QUEUED, RUNNING)
+            ).fetchone()
+            if pending:
+                continue
+            job_dir = _job_output_dir(path, os.path.abspath(output_dir), root) if output_dir else None
+            taken = job_dir is not None and _output_taken(conn, path, job_dir)
+            cursor = conn.execute(
+                "INSERT INTO jobs (path, output_dir, formats, pdf_profile, status, max_attempts, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, job_dir, json.dumps(list(formats)), pdf_profile, QUEUED, max_attempts, now)
+            )
+            if taken:
+                conn.execute("UPDATE jobs SET output_dir = ? WHERE id = ?",
+                             (os.path.join(job_dir, str(cursor.lastrowid)), cursor.lastrowid))
+            added += 1
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return added
+
+def _expire_leases(conn, now):
+    """租约已过期的任务（worker 崩溃或失联）：还有重试次数的回到队列，否则标记为失败"""
+    conn.execute(
+        "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, error = '处理超时（租约过期）' "
+        "WHERE status = ? AND lease_until < ? AND attempts < max_attempts",
+        (QUEUED, RUNNING, now)
+    )
+    conn.execute(
+        "UPDATE jobs SET status = ?, lease_until = NULL, error = '处理超时（租约过期），已达最大重试次数', "
+        "finished_at = ? WHERE status = ? AND lease_until < ?",
+        (FAILED, now, RUNNING, now)
+    )
+
+def claim(conn, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """领取最早的排队任务并获得租约，返回任务字典；没有任务时返回 None"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _expire_leases(conn, now)
+        row = conn.execute(
+            "SELECT id, path, output_dir, formats, pdf_profile, attempts FROM jobs "
+            "WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_until = ?, "
+                "started_at = ? WHERE id = ?",
+                (RUNNING, worker_id, now + lease_seconds, now, row[0])
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if row is None:
+        return None
+    job_id, path, output_dir, formats, pdf_profile, attempts = row
+    return {"id": job_id, "path": path, "output_dir": output_dir, "formats": json.loads(formats),
+            "pdf_profile": pdf_profile, "attempt": attempts + 1}
+
+def heartbeat(conn, job_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """续约；任务已不属于该 worker（租约过期后被他人领取）时返回 False"""
+    cursor = conn.execute(
+        "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+        (time.time() + lease_seconds, job_id, worker_id, RUNNING)
+    )
+    return cursor.rowcount == 1
+
+def complete(conn, job_id, worker_id, outputs):
+    """记录任务成功及输出文件；任务已不属于该 worker 或已不在处理中（如租约过期后被标记失败）时不修改"""
+    conn.execute(
+        "UPDATE jobs SET status = ?, outputs = ?, error = NULL, lease_until = NULL, finished_at = ? "
+        "WHERE id = ? AND worker = ? AND status = ?",
+        (DONE, json.dumps(outputs, ensure_ascii=False), time.time(), job_id, worker_id, RUNNING)
+    )
+
+def fail(conn, job_id, worker_id, error):
+    """记录任务失败：还有重试次数时回到队列，否则标记为失败"""
+    now = time.time()
+    conn.execute(
+        "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN ? ELSE ? END, "
+        "worker = CASE WHEN attempts < max_attempts THEN NULL ELSE worker END, "
+        "error = ?, lease_until = NULL, finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END "
+        "WHERE id = ? AND worker = ? AND status = ?",
+        (QUEUED, FAILED, error, now, job_id, worker_id, RUNNING)
+    )
+
+def release(conn, job_id, worker_id):
+    """worker 主动退出时把任务放回队列，不计入重试次数"""
+    conn.execute(
+        "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, attempts = attempts - 1 "
+        "WHERE id = ? AND worker = ? AND status = ?",
+        (QUEUED, job_id, worker_id, RUNNING)
+    )
+
+def status_counts(conn):
+    """各状态的任务数"""
+    return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+def failed_jobs(conn, limit=20):
+    """最近失败的任务：[(路径, 尝试次数, 错误)]"""
+    return conn.execute(
+        "SELECT path, attempts, error FROM jobs WHERE status = ? ORDER BY finished_at DESC LIMIT ?",
+        (FAILED, limit)
+    ).fetchall()
+
+def _keep_alive(db_path, job_id, worker_id, lease_seconds, stop):
+    """后台线程：处理期间定时续约（使用独立连接）"""
+    conn = open_queue(db_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            try:
+                if not heartbeat(conn, job_id, worker_id, lease_seconds):
+                    logging.warning(f"任务 {job_id} 的租约已失效，结果将不会被记录")
+                    return
+            except sqlite3.Error as e:
+                logging.warning(f"续约失败，稍后重试: {e}")
+    finally:
+        conn.close()
+
+def run_worker(db_path, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS, exit_when_empty=False):
+    """循环领取并处理任务，返回处理的任务数；exit_when_empty 为 True 时队列为空即退出"""
+    worker_id = worker_id or default_worker_id()
+    conn = open_queue(db_path)
+    processed = 0
+    logging.info(f"worker {worker_id} 已启动，队列: {db_path}")
+    try:
+        while True:
+            job = claim(conn, worker_id, lease_seconds)
+            if job is None:
+                if exit_when_empty:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            logging.info(f"领取任务 {job['id']}（第 {job['attempt']} 次）: {job['path']}")
+            stop = threading.Event()
+            keeper = threading.Thread(target=_keep_alive, args=(db_path, job["id"], worker_id, lease_seconds, stop),
+                                      daemon=True)
+            keeper.start()
+            try:
+                if "pdf" in job["formats"]:
+                    register_font()
+                generator = ScriptGenerator()
+                outputs = generator.process_file(job["path"], formats=job["formats"],
+                                                 pdf_profile=job["pdf_profile"], output_dir=job["output_dir"])
+                stop.set()
+                keeper.join()
+                complete(conn, job["id"], worker_id, outputs)
+            except (KeyboardInterrupt, SystemExit):
+                stop.set()
+                keeper.join()
+                release(conn, job["id"], worker_id)
+                raise
+            except Exception as e:
+                stop.set()
+                keeper.join()
+                logging.error(f"任务 {job['id']} 失败: {e}")
+                fail(conn, job["id"], worker_id, str(e))
+            processed += 1
+    finally:
+        conn.close()
+    return processed